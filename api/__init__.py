@@ -2,24 +2,62 @@ from flask import Flask, jsonify
 from flask_restx import Api
 from .auth.views import auth_namespace
 from .orders.views import order_namespace
+from .orders.events import create_order_broker, register_order_subscribers
+from .orders.analytics import create_summary_cache
+from .orders.kitchen import create_kitchen_queue
 from .user.views import user_namespace
 from .config import config_dict
+from .commands import blocklist_cli, orders_cli, idempotency_cli, events_cli
 from .utils import db
-from .models.orders import Order
+from .utils.revocation import create_revocation_store
+from .utils.identity import create_user_cache, user_claims
+from .utils.replicas import create_recent_writers
+from .utils.passwords import create_password_hasher
+from .utils.ratelimit import create_bucket_store
+from .utils.idempotency import create_idempotency_store
+from .utils.pricing import create_price_book
+from .utils.dispatch import create_event_dispatcher
+from .utils.metrics import create_request_metrics, register_request_metrics
+from .models.orders import Order, OrderRollup, OrderStatusEvent
 from .models.users import User
 from .models.blocklist import TokenBlocklist
+from .models.idempotency import IdempotencyKey
+from .models.outbox import OutboxEvent
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import JWTManager
 
 def create_app(config=config_dict['prod']):
     app = Flask(__name__)
     app.config.from_object(config)
+    if app.config['PROXY_FIX_X_FOR'] or app.config['PROXY_FIX_X_PROTO']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=app.config['PROXY_FIX_X_PROTO'])
 
     db.init_app(app)
 
     jwt = JWTManager(app)
     
     migrate = Migrate(app, db)
+    app.cli.add_command(blocklist_cli)
+    app.cli.add_command(orders_cli)
+    app.cli.add_command(idempotency_cli)
+    app.cli.add_command(events_cli)
+
+    revocation_store = create_revocation_store(app)
+    app.extensions['revocation_store'] = revocation_store
+    app.extensions['user_cache'] = create_user_cache(app)
+    app.extensions['password_hasher'] = create_password_hasher(app)
+    app.extensions['rate_limit_store'] = create_bucket_store(app)
+    app.extensions['idempotency_store'] = create_idempotency_store(app)
+    app.extensions['price_book'] = create_price_book(app)
+    app.extensions['replica_recent_writers'] = create_recent_writers(app)
+    app.extensions['order_events'] = create_order_broker(app)
+    app.extensions['event_dispatcher'] = create_event_dispatcher(app)
+    register_order_subscribers(app.extensions['event_dispatcher'])
+    app.extensions['order_summary_cache'] = create_summary_cache(app)
+    app.extensions['kitchen_queue'] = create_kitchen_queue(app)
+    app.extensions['request_metrics'] = create_request_metrics(app)
+    register_request_metrics(app, app.extensions['request_metrics'])
 
     authorization = {
         "Bearer Auth": {
@@ -38,15 +76,22 @@ def create_app(config=config_dict['prod']):
 
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
-        jti = jwt_payload["jti"]
-        token = TokenBlocklist.query.filter_by(jti=jti).first()
-        return token is not None
+        return revocation_store.is_revoked(jwt_payload["jti"], jwt_payload.get("exp"))
+
+    @jwt.user_identity_loader
+    def user_identity_lookup(identity):
+        if isinstance(identity, User):
+            return identity.username
+        return identity
 
     @jwt.additional_claims_loader
     def add_claim_to_jwt(identity):
-        if identity == "promiseee":
-            return {"app_admin": True}
-        return {"app_admin": False}
+        user = identity
+        if not isinstance(user, User):
+            user = User.query.filter_by(username=identity).first()
+        claims = user_claims(user) if user else {}
+        claims["app_admin"] = user_identity_lookup(identity) == "promiseee"
+        return claims
 
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
@@ -96,7 +141,9 @@ def create_app(config=config_dict['prod']):
         return {
             'db': db,
             'user': User,
-            'order': Order
+            'order': Order,
+            'order_rollup': OrderRollup,
+            'order_status_event': OrderStatusEvent
         }
 
     return app
@@ -1,14 +1,28 @@
 from flask_restx import Namespace, Resource, fields
 from flask import request
 from ..models.users import User
-from ..models.blocklist import TokenBlocklist
-from werkzeug.security import generate_password_hash, check_password_hash
+from ..utils import db
+from ..utils.passwords import get_password_hasher
+from ..utils.ratelimit import rate_limit, login_account
 from http import HTTPStatus
+from sqlalchemy.exc import IntegrityError
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt
-from ..utils import db
-from datetime import timezone, datetime
+from ..utils.revocation import get_revocation_store
+
+auth_namespace = Namespace('auth', 'Namespace for authentication', decorators=[
+    rate_limit('auth-ip', 'RATE_LIMIT_AUTH_PER_IP')
+])
 
-auth_namespace = Namespace('auth', 'Namespace for authentication')
+
+def conflicting_field(error, fields):
+    """
+    The first of fields named by the unique constraint or index an
+    IntegrityError reports, e.g. users_email_key on PostgreSQL or
+    "UNIQUE constraint failed: users.email" on SQLite
+    """
+    diag = getattr(error.orig, 'diag', None)
+    message = getattr(diag, 'constraint_name', None) or str(error.orig)
+    return next((field for field in fields if field in message), None)
 
 signup_model = auth_namespace.model(
     'signup', {
@@ -37,17 +51,19 @@ class SignUp(Resource):
         Register a user
         """
         data = request.get_json()
-        user_email = User.query.filter_by(email=data.get('email')).first()
-        user_name = User.query.filter_by(username=data.get('username')).first()
-
-        if user_email or user_name:
-            return {"message": "User already exists"}
         new_user = User(
                 username=data.get('username'),
                 email=data.get('email'),
-                password=generate_password_hash(data.get('password'))
+                password=get_password_hasher().hash(data.get('password'))
             )
-        new_user.save()
+        try:
+            new_user.save()
+        except IntegrityError as error:
+            db.session.rollback()
+            field = conflicting_field(error, ('email', 'username'))
+            if field is None:
+                raise
+            auth_namespace.abort(HTTPStatus.CONFLICT, f"A user with this {field} already exists", field=field)
         return new_user, HTTPStatus.CREATED #NOTE
 
 
@@ -55,17 +71,23 @@ class SignUp(Resource):
 class Login(Resource):
     @auth_namespace.expect(login_model)
     @auth_namespace.doc(description="Login to account on the pizza app")
+    @auth_namespace.response(HTTPStatus.TOO_MANY_REQUESTS, 'Too many login attempts')
+    @rate_limit('login-account', 'RATE_LIMIT_LOGIN_PER_ACCOUNT', key=login_account)
     def post(self):
         """
         Login a user
         """
         data = request.get_json()
         email = data.get('email')
-        user = User.query.filter_by(email=email).first()
+        user = User.get_by_email(email)
 
-        if user and check_password_hash(user.password, data.get('password')):
-            access_token = create_access_token(user.username, fresh=True)
-            refresh_token = create_refresh_token(user.username)
+        hasher = get_password_hasher()
+        if user and hasher.verify(user.password, data.get('password')):
+            if hasher.needs_rehash(user.password):
+                user.password = hasher.hash(data.get('password'))
+                db.session.commit()
+            access_token = create_access_token(user, fresh=True)
+            refresh_token = create_refresh_token(user)
             response = {
                 "access_token": access_token,
                 "refresh_token": refresh_token
@@ -89,9 +111,7 @@ class Logout(Resource):
     @jwt_required(fresh=True)
     @auth_namespace.doc(description="Logout of the pizza app")
     def delete(self):
-        jti = get_jwt()["jti"]
-        token = TokenBlocklist(jti=jti, created_at=datetime.now(timezone.utc))
-        db.session.add(token)
-        db.session.commit()
+        token = get_jwt()
+        get_revocation_store().revoke(token["jti"], token.get("exp"))
         return {"message": "User successfully logged out"}
 
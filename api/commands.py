@@ -0,0 +1,179 @@
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from .utils import db
+from .utils.revocation import max_token_lifetime
+from .models.blocklist import TokenBlocklist
+from .models.orders import Order, OrderRollup
+from .utils.pricing import get_price_table
+from .models.idempotency import IdempotencyKey
+from .models.outbox import OutboxEvent
+from .utils.dispatch import relay_undelivered
+
+blocklist_cli = AppGroup('blocklist', help='Maintain the token blocklist table.')
+orders_cli = AppGroup('orders', help='Maintain order tables.')
+idempotency_cli = AppGroup('idempotency', help='Maintain stored idempotent responses.')
+events_cli = AppGroup('events', help='Deliver and clean up outbox events.')
+
+PARTITION_PREFIX = 'blocklist_p'
+
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'blocklist' AND pg_table_is_visible(c.oid)"
+    )).first() is not None
+
+
+def create_partitions(days):
+    """
+    Create one partition per UTC day from today up to days ahead
+    """
+    today = datetime.utcnow().date()
+    for offset in range(days + 1):
+        start = today + timedelta(days=offset)
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{start:%Y%m%d} PARTITION OF blocklist "
+            f"FOR VALUES FROM ('{start}') TO ('{start + timedelta(days=1)}')"
+        ))
+
+
+def drop_expired_partitions():
+    """
+    Drop the daily partitions whose whole range has expired
+    """
+    today = datetime.utcnow().date()
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'blocklist'"
+    )).scalars().all()
+    dropped = []
+    for name in names:
+        if not name.startswith(PARTITION_PREFIX):
+            continue
+        start = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()
+        if start + timedelta(days=1) <= today:
+            db.session.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    db.session.commit()
+    return dropped
+
+
+def convert_to_partitioned(days, max_lifetime):
+    """
+    Rebuild the blocklist table as a PostgreSQL table range-partitioned on
+    expires_at, keeping only the tokens that have not expired yet
+    """
+    for statement in [
+        "ALTER TABLE blocklist RENAME TO blocklist_unpartitioned",
+        "ALTER TABLE blocklist_unpartitioned RENAME CONSTRAINT blocklist_pkey TO blocklist_unpartitioned_pkey",
+        "ALTER INDEX ix_blocklist_jti RENAME TO ix_blocklist_unpartitioned_jti",
+        "ALTER INDEX ix_blocklist_expires_at RENAME TO ix_blocklist_unpartitioned_expires_at",
+        "CREATE TABLE blocklist ("
+        "id INTEGER NOT NULL DEFAULT nextval('blocklist_id_seq'), "
+        "jti VARCHAR(36) NOT NULL, "
+        "created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "CONSTRAINT blocklist_pkey PRIMARY KEY (id, expires_at)"
+        ") PARTITION BY RANGE (expires_at)",
+        "CREATE INDEX ix_blocklist_jti ON blocklist (jti)",
+        "CREATE INDEX ix_blocklist_expires_at ON blocklist (expires_at)",
+        "CREATE TABLE blocklist_default PARTITION OF blocklist DEFAULT",
+        "ALTER SEQUENCE blocklist_id_seq OWNED BY blocklist.id",
+    ]:
+        db.session.execute(text(statement))
+    create_partitions(days)
+    db.session.execute(text(
+        "INSERT INTO blocklist (id, jti, created_at, expires_at) "
+        "SELECT id, jti, created_at, COALESCE(expires_at, created_at + make_interval(secs => :seconds)) "
+        "FROM blocklist_unpartitioned "
+        "WHERE COALESCE(expires_at, created_at + make_interval(secs => :seconds)) >= timezone('utc', now())"
+    ), {"seconds": max_lifetime.total_seconds()})
+    db.session.execute(text("DROP TABLE blocklist_unpartitioned"))
+
+
+@blocklist_cli.command('purge')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def purge_command(batch_size):
+    """Delete blocklisted tokens that have expired."""
+    if is_partitioned():
+        for name in drop_expired_partitions():
+            click.echo(f'Dropped partition {name}')
+    deleted = TokenBlocklist.purge_expired(batch_size=batch_size, max_lifetime=max_token_lifetime(current_app))
+    click.echo(f'Deleted {deleted} expired tokens')
+
+
+@blocklist_cli.command('partition')
+@click.option('--days', default=7, show_default=True, help='Number of days ahead to create partitions for.')
+def partition_command(days):
+    """Partition the blocklist table by day on PostgreSQL."""
+    if db.engine.dialect.name != 'postgresql':
+        raise click.ClickException('Partitioning is only supported on PostgreSQL')
+    if is_partitioned():
+        create_partitions(days)
+    else:
+        convert_to_partitioned(days, max_token_lifetime(current_app))
+        click.echo('Converted blocklist to a partitioned table')
+    db.session.commit()
+    click.echo(f'Partitions exist up to {datetime.utcnow().date() + timedelta(days=days)}')
+
+
+@orders_cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """Recompute the order_rollup table from the orders table."""
+    OrderRollup.rebuild()
+    click.echo(f'Rebuilt {db.session.query(OrderRollup).count()} rollup buckets')
+
+
+@orders_cli.command('backfill-prices')
+@click.option('--batch-size', default=1000, show_default=True, help='Orders priced per transaction.')
+def backfill_prices_command(batch_size):
+    """Price orders placed before unit_price and total existed."""
+    priced = 0
+    while True:
+        orders = Order.query.filter(Order.unit_price.is_(None)).order_by(Order.id).limit(batch_size).all()
+        for order in orders:
+            order.set_price(get_price_table())
+        db.session.commit()
+        priced += len(orders)
+        if len(orders) < batch_size:
+            break
+    click.echo(f'Priced {priced} orders')
+
+
+@idempotency_cli.command('purge')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def purge_idempotency_command(batch_size):
+    """Delete idempotency keys that have expired."""
+    deleted = IdempotencyKey.purge_expired(batch_size=batch_size)
+    click.echo(f'Deleted {deleted} expired idempotency keys')
+
+
+@events_cli.command('relay')
+@click.option('--batch-size', default=1000, show_default=True, help='Events fetched per batch.')
+def relay_events_command(batch_size):
+    """Deliver outbox events that were never marked dispatched."""
+    older_than = datetime.utcnow() - timedelta(seconds=current_app.config['EVENTS_RELAY_AFTER'])
+    delivered = failed = 0
+    after = None
+    while True:
+        fetched, count, after = relay_undelivered(older_than, limit=batch_size, after=after)
+        delivered += count
+        failed += fetched - count
+        if fetched < batch_size:
+            break
+    click.echo(f'Delivered {delivered} outbox events, {failed} failed')
+
+
+@events_cli.command('purge')
+@click.option('--days', default=7, show_default=True, help='Keep dispatched events for this many days.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+def purge_events_command(days, batch_size):
+    """Delete outbox events dispatched more than --days ago."""
+    deleted = OutboxEvent.purge_dispatched(datetime.utcnow() - timedelta(days=days), batch_size=batch_size)
+    click.echo(f'Deleted {deleted} dispatched outbox events')
@@ -1,18 +1,116 @@
 import os
-from decouple import config
+from decouple import config, Csv
 import re
 from datetime import timedelta
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
-url = config('DATABASE_URL')
-if url.startswith('postgres://'):
-    url = url.replace('postgres://', 'postgresql://', 1)
+
+
+def database_url(url):
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+url = database_url(config('DATABASE_URL'))
+replica_urls = [database_url(replica) for replica in config('DATABASE_REPLICA_URLS', '', cast=Csv())]
+
+
+def engine_options(url):
+    """
+    SQLAlchemy engine options for url. The pool is per gunicorn worker, so it
+    is sized from the number of threads each worker runs.
+    """
+    options = {
+        'pool_pre_ping': config('DB_POOL_PRE_PING', True, cast=bool),
+        'pool_recycle': config('DB_POOL_RECYCLE', 1800, cast=int)
+    }
+    if url.startswith('sqlite'):
+        return options
+
+    threads = config('GUNICORN_THREADS', 1, cast=int)
+    options['pool_size'] = config('DB_POOL_SIZE', threads, cast=int)
+    options['max_overflow'] = config('DB_MAX_OVERFLOW', threads, cast=int)
+    options['pool_timeout'] = config('DB_POOL_TIMEOUT', 10, cast=int)
+
+    if url.startswith('postgresql'):
+        connect_args = {'connect_timeout': config('DB_CONNECT_TIMEOUT', 10, cast=int)}
+        statement_timeout = config('DB_STATEMENT_TIMEOUT', 30000, cast=int)
+        if config('DB_PGBOUNCER', False, cast=bool):
+            # PgBouncer in transaction mode rejects startup options and cannot
+            # keep prepared statements, so statement_timeout has to be set on
+            # the database role instead.
+            if url.startswith('postgresql+psycopg:'):
+                connect_args['prepare_threshold'] = None
+        elif statement_timeout:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+        options['connect_args'] = connect_args
+    return options
 
 class Config:
     SECRET_KEY = config('SECRET_KEY', 'secret')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(minutes=30)
     JWT_SECRET_KEY = config('JWT_SECRET_KEY', 'topsecret')
+    PROPAGATE_EXCEPTIONS = True
+    SQLALCHEMY_REPLICAS = []
+    PASSWORD_HASH_METHOD = config('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', 260000, cast=int)
+    PASSWORD_SALT_LENGTH = config('PASSWORD_SALT_LENGTH', 16, cast=int)
+    PASSWORD_HASH_EXECUTOR = config('PASSWORD_HASH_EXECUTOR', '')
+    PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', 0, cast=int)
+    PROXY_FIX_X_FOR = config('PROXY_FIX_X_FOR', 0, cast=int)
+    PROXY_FIX_X_PROTO = config('PROXY_FIX_X_PROTO', 0, cast=int)
+    RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+    RATE_LIMIT_STORE_SIZE = config('RATE_LIMIT_STORE_SIZE', 100000, cast=int)
+    RATE_LIMIT_AUTH_PER_IP = config('RATE_LIMIT_AUTH_PER_IP', '60/minute')
+    RATE_LIMIT_LOGIN_PER_ACCOUNT = config('RATE_LIMIT_LOGIN_PER_ACCOUNT', '10/minute')
+    IDEMPOTENCY_BACKEND = config('IDEMPOTENCY_BACKEND', 'database')
+    IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', 86400, cast=int)
+    IDEMPOTENCY_WAIT = config('IDEMPOTENCY_WAIT', 10, cast=float)
+    IDEMPOTENCY_LEASE = config('IDEMPOTENCY_LEASE', 60, cast=int)
+    IDEMPOTENCY_CACHE_SIZE = config('IDEMPOTENCY_CACHE_SIZE', 100000, cast=int)
+    REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', 5, cast=int)
+    REPLICA_STICKY_BACKEND = config('REPLICA_STICKY_BACKEND', 'memory')
+    REPLICA_STICKY_REDIS_URL = config('REPLICA_STICKY_REDIS_URL', 'redis://localhost:6379/0')
+    ORDERS_PAGE_SIZE = config('ORDERS_PAGE_SIZE', 50, cast=int)
+    ORDERS_MAX_PAGE_SIZE = config('ORDERS_MAX_PAGE_SIZE', 200, cast=int)
+    ORDERS_MAX_BATCH_SIZE = config('ORDERS_MAX_BATCH_SIZE', 100, cast=int)
+    ORDERS_EXPORT_BATCH_SIZE = config('ORDERS_EXPORT_BATCH_SIZE', 1000, cast=int)
+    PRICES_FILE = config('PRICES_FILE', '')
+    PRICES_CHECK_INTERVAL = config('PRICES_CHECK_INTERVAL', 30, cast=int)
+    KITCHEN_OVEN_CAPACITY = config('KITCHEN_OVEN_CAPACITY', 8, cast=int)
+    KITCHEN_BATCH_WEIGHT = config('KITCHEN_BATCH_WEIGHT', 60, cast=int)
+    KITCHEN_RESYNC_INTERVAL = config('KITCHEN_RESYNC_INTERVAL', 5, cast=int)
+    KITCHEN_RESYNC_OVERLAP = config('KITCHEN_RESYNC_OVERLAP', 10, cast=int)
+    ORDER_ROLLUP = config('ORDER_ROLLUP', False, cast=bool)
+    ORDER_SUMMARY_CACHE_TTL = config('ORDER_SUMMARY_CACHE_TTL', 30, cast=int)
+    USER_CACHE_TTL = config('USER_CACHE_TTL', 0, cast=int)
+    USER_CACHE_SIZE = config('USER_CACHE_SIZE', 10000, cast=int)
+    EVENTS_WORKERS = config('EVENTS_WORKERS', 2, cast=int)
+    EVENTS_QUEUE_SIZE = config('EVENTS_QUEUE_SIZE', 1000, cast=int)
+    EVENTS_OUTBOX = config('EVENTS_OUTBOX', False, cast=bool)
+    EVENTS_SUBMIT_TIMEOUT = config('EVENTS_SUBMIT_TIMEOUT', 5, cast=float)
+    EVENTS_RELAY_AFTER = config('EVENTS_RELAY_AFTER', 60, cast=int)
+    ORDER_EVENTS_BROKER = config('ORDER_EVENTS_BROKER', 'memory')
+    ORDER_EVENTS_REDIS_URL = config('ORDER_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+    ORDER_EVENTS_CHANNEL = config('ORDER_EVENTS_CHANNEL', 'order-events')
+    ORDER_EVENTS_QUEUE_SIZE = config('ORDER_EVENTS_QUEUE_SIZE', 100, cast=int)
+    ORDER_EVENTS_HEARTBEAT = config('ORDER_EVENTS_HEARTBEAT', 15, cast=int)
+    METRICS_ENABLED = config('METRICS_ENABLED', True, cast=bool)
+    METRICS_SLOW_REQUEST_MS = config('METRICS_SLOW_REQUEST_MS', 0, cast=int)
+    METRICS_SLOW_STATEMENTS = config('METRICS_SLOW_STATEMENTS', 20, cast=int)
+    # /metrics answers only "Authorization: Bearer <METRICS_TOKEN>", and 404 while unset
+    METRICS_TOKEN = config('METRICS_TOKEN', '')
+    REVOCATION_BACKEND = config('REVOCATION_BACKEND', 'database')
+    REVOCATION_REDIS_URL = config('REVOCATION_REDIS_URL', 'redis://localhost:6379/0')
+    REVOCATION_CACHE = config('REVOCATION_CACHE', True, cast=bool)
+    REVOCATION_CACHE_SIZE = config('REVOCATION_CACHE_SIZE', 10000, cast=int)
+    REVOCATION_CACHE_NEGATIVE_TTL = config('REVOCATION_CACHE_NEGATIVE_TTL', 5, cast=int)
+    REVOCATION_BLOOM_FILTER = config('REVOCATION_BLOOM_FILTER', False, cast=bool)
+    REVOCATION_BLOOM_CAPACITY = config('REVOCATION_BLOOM_CAPACITY', 100000, cast=int)
+    REVOCATION_BLOOM_REFRESH = config('REVOCATION_BLOOM_REFRESH', 60, cast=int)
 
 class DevConfig(Config):
     DEBUG = config('DEBUG', cast=bool)
@@ -25,11 +123,19 @@ class TestConfig(Config):
     SQLALCHEMY_ECHO = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI =  'sqlite://'
+    REVOCATION_BACKEND = 'memory'
+    PASSWORD_HASH_ITERATIONS = 1000
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI =  url
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(url)
+    SQLALCHEMY_BINDS = {f'replica_{index}': replica for index, replica in enumerate(replica_urls)}
+    SQLALCHEMY_REPLICAS = list(SQLALCHEMY_BINDS)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = config('DEBUG', False, cast=bool)
+    # the Heroku router is one proxy hop in front of gunicorn
+    PROXY_FIX_X_FOR = config('PROXY_FIX_X_FOR', 1, cast=int)
+    PROXY_FIX_X_PROTO = config('PROXY_FIX_X_PROTO', 1, cast=int)
 
     
 
@@ -1,7 +1,38 @@
 from ..utils import db
+from datetime import datetime
 
 class TokenBlocklist(db.Model):
     __tablename__ = 'blocklist'
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, index=True)
     created_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    @classmethod
+    def expired(cls, now=None, max_lifetime=None):
+        """
+        Filter matching tokens that have expired. Rows written before
+        expires_at existed are treated as expired max_lifetime after logout
+        """
+        now = now or datetime.utcnow()
+        condition = cls.expires_at < now
+        if max_lifetime is not None:
+            condition = db.or_(condition, db.and_(cls.expires_at.is_(None), cls.created_at < now - max_lifetime))
+        return condition
+
+    @classmethod
+    def purge_expired(cls, batch_size=1000, now=None, max_lifetime=None):
+        """
+        Delete expired tokens batch_size rows per transaction and return
+        the number of rows deleted
+        """
+        condition = cls.expired(now, max_lifetime)
+        deleted = 0
+        while True:
+            ids = [id for id, in db.session.query(cls.id).filter(condition).limit(batch_size)]
+            if ids:
+                db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
@@ -0,0 +1,36 @@
+from ..utils import db
+from datetime import datetime
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response stored for an Idempotency-Key. status_code is null while the
+    first request with the key is still running, and expires_at is then the
+    end of its lease
+    """
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False, unique=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    headers = db.Column(db.Text)
+    body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @classmethod
+    def purge_expired(cls, batch_size=1000, now=None):
+        """
+        Delete expired keys batch_size rows per transaction and return the
+        number of rows deleted
+        """
+        now = now or datetime.utcnow()
+        deleted = 0
+        while True:
+            ids = [id for id, in db.session.query(cls.id).filter(cls.expires_at < now).limit(batch_size)]
+            if ids:
+                db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
@@ -1,6 +1,10 @@
 from ..utils import db
 from enum import Enum
 from datetime import datetime
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from ..utils.pricing import get_price_table
+from ..utils.dispatch import record_event
 
 
 class Sizes(Enum):
@@ -15,6 +19,13 @@ class OrderStatus(Enum):
     IN_TRANSIT = 'in_transit'
     DELIVERED = 'delivered'
 
+    def previous(self):
+        """
+        Statuses an order may move to this status from
+        """
+        members = list(OrderStatus)
+        return members[:members.index(self)]
+
 class OrderFlavour(Enum):
     BBQ_CHICKEN = 'bbq_chicken'
     PEPPERONI = 'pepperoni'
@@ -26,8 +37,23 @@ class OrderFlavour(Enum):
     MARGHERITA = 'margherita'
 
 
+def as_member(enum, value):
+    """
+    value as a member of enum; the views assign member names
+    """
+    return value if value is None or isinstance(value, enum) else enum[value]
+
+
 class Order(db.Model):
     __tablename__='orders'
+    __table_args__ = (
+        db.Index('ix_orders_date_created_id', 'date_created', 'id'),
+        db.Index('ix_orders_order_status_date_created_id', 'order_status', 'date_created', 'id'),
+        db.Index('ix_orders_flavour_date_created_id', 'flavour', 'date_created', 'id'),
+        db.Index('ix_orders_sizes_date_created_id', 'sizes', 'date_created', 'id'),
+        db.Index('ix_orders_customer_date_created_id', 'customer', 'date_created', 'id'),
+        db.Index('ix_orders_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     sizes = db.Column(db.Enum(Sizes), default=Sizes.SMALL)
     quantity = db.Column(db.Integer, default=1)
@@ -35,18 +61,331 @@ class Order(db.Model):
     flavour = db.Column(db.Enum(OrderFlavour), nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
     customer = db.Column(db.Integer, db.ForeignKey('users.id'))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    unit_price = db.Column(db.Numeric(10, 2))
+    total = db.Column(db.Numeric(12, 2))
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return f'<Order {self.id}>'
 
+    def rollup_change(self, sign, **values):
+        """
+        (date_created, customer, flavour, sizes, order_status, orders, quantity, revenue)
+        for adding (sign=1) or removing (sign=-1) this order from the rollup,
+        with values overriding the current attributes
+        """
+        key = [values.get(name, getattr(self, name)) for name in ROLLUP_ATTRIBUTES]
+        quantity = values.get('quantity', self.quantity) or 0
+        total = values.get('total', self.total) or 0
+        return (*key, sign, sign * quantity, sign * total)
+
+    def event_payload(self):
+        return {
+            'id': self.id,
+            'customer': self.customer,
+            'flavour': getattr(self.flavour, 'name', self.flavour),
+            'sizes': getattr(self.sizes, 'name', self.sizes),
+            'quantity': self.quantity,
+            'order_status': getattr(self.order_status, 'name', self.order_status),
+            'version': self.version
+        }
+
+    def attribute_changed(self, name):
+        """
+        Whether the pending flush changes an attribute. Enum columns compare
+        by member, so assigning the name of the current member is no change.
+        """
+        history = db.inspect(self).attrs[name].history
+        if not history.deleted:
+            return bool(history.added)
+        enum = ENUM_ATTRIBUTES.get(name)
+        if enum is None:
+            return True
+        return as_member(enum, history.deleted[0]) != as_member(enum, getattr(self, name))
+
+    def set_price(self, price_table):
+        """
+        Price the order at the current unit price when it is new or its size
+        or flavour changed, and keep total in line with quantity
+        """
+        repriced = self.unit_price is None or self.attribute_changed('sizes') or self.attribute_changed('flavour')
+        if repriced:
+            self.unit_price = price_table.unit_price(self.sizes or Sizes.SMALL, self.flavour)
+        self.total = self.unit_price * (self.quantity if self.quantity is not None else 1)
+
+    @staticmethod
+    def price_row(row, price_table):
+        """
+        Row for bulk inserts with unit_price and total filled in
+        """
+        unit_price = price_table.unit_price(row.get('sizes') or Sizes.SMALL, row['flavour'])
+        return dict(row, unit_price=unit_price, total=unit_price * row.get('quantity', 1))
+
+    @classmethod
+    def select_rows(cls, *criteria):
+        """
+        SELECT of just the columns the order views serialize. Executing it
+        gives plain rows that skip identity map and change tracking.
+        """
+        return db.select(
+            cls.id, cls.sizes, cls.order_status, cls.flavour, cls.quantity, cls.unit_price, cls.total, cls.date_created, cls.customer
+        ).where(*criteria)
+
     def save(self):
         db.session.add(self)
         db.session.commit()
 
+    @classmethod
+    def bulk_create(cls, rows):
+        """
+        Insert many orders with one INSERT ... RETURNING in a single transaction.
+        Returns plain column rows rather than instances, which the commit would
+        expire and reload one SELECT at a time when serialized.
+        """
+        price_table = get_price_table()
+        rows = [cls.price_row(row, price_table) for row in rows]
+        orders = db.session.execute(
+            db.insert(cls).returning(*cls.select_rows().selected_columns, cls.version), rows
+        ).all()
+        for order in orders:
+            # the rows carry every attribute event_payload and rollup_change read
+            record_event(db.session(), db.session.connection(), 'order_created', cls.event_payload(order))
+        OrderStatusEvent.record(db.session, [(order.id, order.order_status, order.date_created) for order in orders])
+        if OrderRollup.enabled():
+            OrderRollup.apply(db.session, [cls.rollup_change(order, 1) for order in orders])
+        db.session.commit()
+        return orders
+
+    @classmethod
+    def bulk_update_status(cls, order_status, ids=None, criteria=()):
+        """
+        Move the matching orders that are allowed to transition to order_status
+        with a single UPDATE and return (id, customer, version) of those that changed.
+        With the rollup enabled there is one UPDATE per previous status so that
+        each changed order can be moved out of its old bucket.
+        """
+        previous = order_status.previous()
+        rollup = OrderRollup.enabled()
+        now = datetime.utcnow()
+        updated = []
+        for statuses in ([[status] for status in previous] if rollup else [previous]):
+            statement = db.update(cls).where(cls.order_status.in_(statuses), *criteria)
+            if ids is not None:
+                statement = statement.where(cls.id.in_(ids))
+            statement = statement.values(order_status=order_status, version=cls.version + 1, updated_at=now).returning(
+                cls.id, cls.customer, cls.version, cls.date_created, cls.flavour, cls.sizes, cls.quantity, cls.total
+            )
+            rows = db.session.execute(statement, execution_options={'synchronize_session': False}).all()
+            if rollup:
+                OrderRollup.apply(db.session, [
+                    change
+                    for id, customer, version, date_created, flavour, sizes, quantity, total in rows
+                    for change in [
+                        (date_created, customer, flavour, sizes, statuses[0], -1, -(quantity or 0), -(total or 0)),
+                        (date_created, customer, flavour, sizes, order_status, 1, quantity or 0, total or 0)
+                    ]
+                ])
+            updated.extend((id, customer, version) for id, customer, version, *rest in rows)
+        OrderStatusEvent.record(db.session, [(id, order_status, now) for id, customer, version in updated])
+        for id, customer, version in updated:
+            record_event(db.session(), db.session.connection(), 'status_changed', {
+                'id': id, 'customer': customer, 'order_status': order_status.name, 'version': version
+            })
+        db.session.commit()
+        return updated
+
+    @classmethod
+    def validators(cls, id):
+        """
+        Version and last update time of an order, without loading it
+        """
+        return db.session.query(cls.version, cls.updated_at).filter_by(id=id).first()
+
+    @classmethod
+    def customer_validators(cls, customer):
+        """
+        Aggregates that change whenever any order of a customer is placed,
+        updated or deleted
+        """
+        return db.session.query(
+            db.func.count(cls.id), db.func.max(cls.id), db.func.sum(cls.version)
+        ).filter_by(customer=customer).one()
+
     @classmethod
     def get_by_id(cls, id):
         return cls.query.get_or_404(id)
 
     def delete_by_id(self):
         db.session.delete(self)
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+
+ENUM_ATTRIBUTES = {'sizes': Sizes, 'flavour': OrderFlavour, 'order_status': OrderStatus}
+ROLLUP_ATTRIBUTES = ('date_created', 'customer', 'flavour', 'sizes', 'order_status')
+
+
+class OrderRollup(db.Model):
+    """
+    Order counts and quantities per day, customer, flavour, size and status,
+    kept up to date as orders change when ORDER_ROLLUP is set
+    """
+    __tablename__ = 'order_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    customer = db.Column(db.Integer, primary_key=True, comment='0 for orders without a customer')
+    flavour = db.Column(db.Enum(OrderFlavour), primary_key=True)
+    sizes = db.Column(db.Enum(Sizes), primary_key=True)
+    order_status = db.Column(db.Enum(OrderStatus), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0, server_default='0')
+
+    @staticmethod
+    def enabled():
+        return current_app.config['ORDER_ROLLUP']
+
+    @classmethod
+    def apply(cls, executor, changes):
+        """
+        Add (date_created, customer, flavour, sizes, order_status, orders, quantity, revenue)
+        changes to their buckets with one upsert. executor is a session or a
+        connection.
+        """
+        buckets = {}
+        for date_created, customer, flavour, sizes, order_status, orders, quantity, revenue in changes:
+            key = (
+                date_created.date(), customer or 0,
+                as_member(OrderFlavour, flavour), as_member(Sizes, sizes), as_member(OrderStatus, order_status)
+            )
+            total = buckets.get(key, (0, 0, 0))
+            buckets[key] = (total[0] + orders, total[1] + quantity, total[2] + revenue)
+        if not buckets:
+            return
+        rows = [
+            dict(zip(('day', 'customer', 'flavour', 'sizes', 'order_status'), key), orders=orders, quantity=quantity, revenue=revenue)
+            for key, (orders, quantity, revenue) in buckets.items()
+        ]
+        insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}[db.engine.dialect.name]
+        statement = insert(cls).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=['day', 'customer', 'flavour', 'sizes', 'order_status'],
+            set_={
+                'orders': cls.orders + statement.excluded.orders,
+                'quantity': cls.quantity + statement.excluded.quantity,
+                'revenue': cls.revenue + statement.excluded.revenue
+            }
+        )
+        executor.execute(statement)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recompute every bucket from the orders table
+        """
+        db.session.execute(db.delete(cls))
+        db.session.execute(db.insert(cls).from_select(
+            ['day', 'customer', 'flavour', 'sizes', 'order_status', 'orders', 'quantity', 'revenue'],
+            db.select(
+                db.func.date(Order.date_created), db.func.coalesce(Order.customer, 0), Order.flavour, Order.sizes,
+                Order.order_status, db.func.count(Order.id), db.func.coalesce(db.func.sum(Order.quantity), 0),
+                db.func.coalesce(db.func.sum(Order.total), 0)
+            ).where(
+                Order.date_created.is_not(None), Order.sizes.is_not(None), Order.order_status.is_not(None)
+            ).group_by(db.func.date(Order.date_created), db.func.coalesce(Order.customer, 0), Order.flavour, Order.sizes, Order.order_status)
+        ))
+        db.session.commit()
+
+
+class OrderStatusEvent(db.Model):
+    """
+    Append-only history of order statuses, one row when an order is placed
+    and one for every status change, written in the same transaction
+    """
+    __tablename__ = 'order_status_events'
+    __table_args__ = (
+        db.Index('ix_order_status_events_order_id_at', 'order_id', 'at'),
+        db.Index('ix_order_status_events_status_at', 'status', 'at'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    order_id = db.Column(db.Integer, nullable=False, comment='Kept after the order is deleted')
+    status = db.Column(db.Enum(OrderStatus), nullable=False)
+    at = db.Column(db.DateTime, nullable=False)
+
+    @classmethod
+    def record(cls, executor, events):
+        """
+        Insert (order_id, status, at) rows through a session or connection
+        """
+        rows = [{'order_id': order_id, 'status': status, 'at': at} for order_id, status, at in events]
+        if rows:
+            executor.execute(db.insert(cls), rows)
+
+    @classmethod
+    def timeline(cls, order_id):
+        return db.session.execute(
+            db.select(cls.status, cls.at).where(cls.order_id == order_id).order_by(cls.at, cls.id)
+        ).all()
+
+
+@db.event.listens_for(Order, 'before_insert')
+@db.event.listens_for(Order, 'before_update')
+def price_order(mapper, connection, target):
+    target.set_price(get_price_table())
+
+
+@db.event.listens_for(Order, 'after_insert')
+def add_to_rollup(mapper, connection, target):
+    if OrderRollup.enabled():
+        OrderRollup.apply(connection, [target.rollup_change(1)])
+
+
+@db.event.listens_for(Order, 'after_update')
+def move_in_rollup(mapper, connection, target):
+    if not OrderRollup.enabled():
+        return
+    state = db.inspect(target)
+    previous = {
+        name: state.attrs[name].history.deleted[0]
+        for name in ROLLUP_ATTRIBUTES + ('quantity', 'total')
+        if state.attrs[name].history.deleted
+    }
+    if previous:
+        OrderRollup.apply(connection, [target.rollup_change(-1, **previous), target.rollup_change(1)])
+
+
+@db.event.listens_for(Order, 'after_delete')
+def remove_from_rollup(mapper, connection, target):
+    if OrderRollup.enabled():
+        OrderRollup.apply(connection, [target.rollup_change(-1)])
+
+
+@db.event.listens_for(Order, 'after_insert')
+def add_status_event(mapper, connection, target):
+    OrderStatusEvent.record(connection, [(target.id, target.order_status, target.date_created)])
+
+
+@db.event.listens_for(Order, 'after_update')
+def append_status_event(mapper, connection, target):
+    if target.attribute_changed('order_status'):
+        OrderStatusEvent.record(connection, [(target.id, target.order_status, datetime.utcnow())])
+
+
+@db.event.listens_for(Order, 'after_insert')
+def order_created(mapper, connection, target):
+    record_event(db.inspect(target).session, connection, 'order_created', target.event_payload())
+
+
+@db.event.listens_for(Order, 'after_update')
+def order_updated(mapper, connection, target):
+    if db.inspect(target).attrs.order_status.history.deleted:
+        payload = target.event_payload()
+        record_event(db.inspect(target).session, connection, 'status_changed', {
+            name: payload[name] for name in ('id', 'customer', 'order_status', 'version')
+        })
+
+
+@db.event.listens_for(Order, 'after_delete')
+def order_deleted(mapper, connection, target):
+    record_event(db.inspect(target).session, connection, 'order_deleted', {'id': target.id, 'customer': target.customer})
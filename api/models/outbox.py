@@ -0,0 +1,42 @@
+from ..utils import db
+from datetime import datetime
+
+
+class OutboxEvent(db.Model):
+    """
+    Domain event written in the transaction that caused it; dispatched_at is
+    set once every subscriber has handled it
+    """
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    dispatched_at = db.Column(db.DateTime, index=True)
+
+    @classmethod
+    def undelivered(cls, older_than, limit=1000, after=None):
+        """
+        Undelivered events created before older_than in (created_at, id)
+        order, starting after the (created_at, id) of a previous batch
+        """
+        query = cls.query.filter(cls.dispatched_at.is_(None), cls.created_at < older_than)
+        if after is not None:
+            query = query.filter(db.tuple_(cls.created_at, cls.id) > after)
+        return query.order_by(cls.created_at, cls.id).limit(limit).all()
+
+    @classmethod
+    def purge_dispatched(cls, before, batch_size=1000):
+        """
+        Delete events dispatched before a time, batch_size rows per
+        transaction, and return the number of rows deleted
+        """
+        deleted = 0
+        while True:
+            ids = [id for id, in db.session.query(cls.id).filter(cls.dispatched_at < before).limit(batch_size)]
+            if ids:
+                db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
@@ -1,4 +1,5 @@
 from ..utils import db
+from sqlalchemy.orm import joinedload
 
 
 class User(db.Model):
@@ -22,6 +23,22 @@ class User(db.Model):
     def get_by_id(cls, id):
         return cls.query.get_or_404(id)
 
+    @classmethod
+    def get_by_email(cls, email):
+        """
+        Case-insensitive lookup that uses the lower(email) index
+        """
+        if email is None:
+            return None
+        return cls.query.filter(db.func.lower(cls.email) == email.lower()).first()
+
+    @classmethod
+    def get_with_orders(cls, id):
+        """
+        Load a user and their orders in a single query
+        """
+        return cls.query.options(joinedload(cls.orders)).filter_by(id=id).first_or_404()
+
     def make_admin(self):
         """
         Gives user admin privileges
@@ -29,3 +46,5 @@ class User(db.Model):
         self.is_staff = True
         db.session.commit()
 
+
+db.Index('ix_users_email_lower', db.func.lower(User.email), unique=True)
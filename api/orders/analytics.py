@@ -0,0 +1,165 @@
+import math
+from datetime import datetime, time, timedelta
+from flask import current_app
+from ..models.orders import Order, OrderRollup, OrderStatusEvent, OrderFlavour, OrderStatus, Sizes
+from ..utils import db
+from ..utils.cache import TTLCache, MISSING
+
+DIMENSIONS = ('flavour', 'sizes', 'order_status', 'day', 'customer')
+ENUM_DIMENSIONS = {'flavour': OrderFlavour, 'sizes': Sizes, 'order_status': OrderStatus}
+PERCENTILES = (50, 95)
+
+
+def create_summary_cache(app):
+    if app.config['ORDER_SUMMARY_CACHE_TTL'] <= 0:
+        return None
+    return TTLCache(maxsize=1000, ttl=app.config['ORDER_SUMMARY_CACHE_TTL'])
+
+
+def _bucket_key(dimension, value):
+    if dimension == 'day':
+        return str(value)
+    if dimension == 'customer':
+        return value or None
+    return value.name
+
+
+def _summary_source(created_after, created_before):
+    """
+    Columns and criteria to aggregate over, from the rollup table when it is
+    maintained and from the orders table otherwise
+    """
+    if OrderRollup.enabled():
+        columns = {
+            'flavour': OrderRollup.flavour,
+            'sizes': OrderRollup.sizes,
+            'order_status': OrderRollup.order_status,
+            'day': OrderRollup.day,
+            'customer': OrderRollup.customer
+        }
+        totals = (
+            db.func.coalesce(db.func.sum(OrderRollup.orders), 0),
+            db.func.coalesce(db.func.sum(OrderRollup.quantity), 0),
+            db.func.coalesce(db.func.sum(OrderRollup.revenue), 0)
+        )
+        criteria = []
+        if created_after:
+            criteria.append(OrderRollup.day >= created_after)
+        if created_before:
+            criteria.append(OrderRollup.day <= created_before)
+        return columns, totals, criteria
+
+    columns = {
+        'flavour': Order.flavour,
+        'sizes': Order.sizes,
+        'order_status': Order.order_status,
+        'day': db.func.date(Order.date_created),
+        'customer': Order.customer
+    }
+    totals = (
+        db.func.count(Order.id),
+        db.func.coalesce(db.func.sum(Order.quantity), 0),
+        db.func.coalesce(db.func.sum(Order.total), 0)
+    )
+    criteria = []
+    if created_after:
+        criteria.append(Order.date_created >= datetime.combine(created_after, time.min))
+    if created_before:
+        criteria.append(Order.date_created < datetime.combine(created_before + timedelta(days=1), time.min))
+    return columns, totals, criteria
+
+
+def compute_summary(created_after=None, created_before=None):
+    """
+    Order, quantity and revenue totals overall and grouped by each
+    dimension, with one GROUP BY query per dimension
+    """
+    columns, totals, criteria = _summary_source(created_after, created_before)
+    orders, quantity, revenue = db.session.execute(db.select(*totals).where(*criteria)).one()
+    summary = {'orders': orders, 'quantity': quantity, 'revenue': revenue}
+    for dimension in DIMENSIONS:
+        column = columns[dimension]
+        rows = db.session.execute(
+            db.select(column, *totals).where(*criteria).group_by(column).having(totals[0] > 0).order_by(column)
+        ).all()
+        if dimension in ENUM_DIMENSIONS:
+            # PostgreSQL sorts enums in declaration order, SQLite by name
+            members = list(ENUM_DIMENSIONS[dimension])
+            rows.sort(key=lambda row: members.index(row[0]))
+        summary[dimension] = [
+            {'key': _bucket_key(dimension, value), 'orders': orders, 'quantity': quantity, 'revenue': revenue}
+            for value, orders, quantity, revenue in rows
+        ]
+    return summary
+
+
+def order_summary(created_after=None, created_before=None):
+    """
+    compute_summary through the short-lived summary cache when
+    ORDER_SUMMARY_CACHE_TTL is set
+    """
+    cache = current_app.extensions.get('order_summary_cache')
+    key = (created_after, created_before)
+    summary = MISSING if cache is None else cache.get(key)
+    if summary is MISSING:
+        summary = compute_summary(created_after, created_before)
+        if cache is not None:
+            cache.set(key, summary)
+    return summary
+
+
+def _seconds_between(start, end):
+    if db.engine.dialect.name == 'postgresql':
+        return db.extract('epoch', end - start)
+    return (db.func.julianday(end) - db.func.julianday(start)) * 86400
+
+
+def status_durations(order_status, since, until):
+    """
+    Subquery of the seconds each order took from its first PENDING event to
+    first reaching order_status, for orders that reached it in [since, until).
+    The window is read from the (status, at) index and placement times
+    from the (order_id, at) index.
+    """
+    reached = (
+        db.select(OrderStatusEvent.order_id, db.func.min(OrderStatusEvent.at).label('at'))
+        .where(OrderStatusEvent.status == order_status, OrderStatusEvent.at >= since, OrderStatusEvent.at < until)
+        .group_by(OrderStatusEvent.order_id)
+        .subquery()
+    )
+    placed = db.aliased(OrderStatusEvent)
+    placed_at = db.func.min(placed.at)
+    return (
+        db.select(_seconds_between(placed_at, reached.c.at).label('seconds'))
+        .select_from(reached)
+        .join(placed, db.and_(placed.order_id == reached.c.order_id, placed.status == OrderStatus.PENDING))
+        .group_by(reached.c.order_id, reached.c.at)
+        .subquery()
+    )
+
+
+def status_percentiles(order_status, since, until, percentiles=PERCENTILES):
+    """
+    Number of orders that reached order_status in [since, until) and the
+    nearest-rank percentiles of their time since placement in seconds,
+    computed by the database. PostgreSQL uses percentile_disc; elsewhere
+    each percentile is one ORDER BY ... LIMIT 1 OFFSET query.
+    """
+    durations = status_durations(order_status, since, until)
+    seconds = durations.c.seconds
+    if db.engine.dialect.name == 'postgresql':
+        count, *values = db.session.execute(db.select(
+            db.func.count(),
+            *(db.func.percentile_disc(p / 100).within_group(seconds) for p in percentiles)
+        ).select_from(durations)).one()
+    else:
+        count = db.session.execute(db.select(db.func.count()).select_from(durations)).scalar()
+        values = [
+            db.session.execute(
+                db.select(seconds).order_by(seconds).offset(max(math.ceil(p / 100 * count) - 1, 0)).limit(1)
+            ).scalar() if count else None
+            for p in percentiles
+        ]
+    result = {'order_status': order_status.name, 'since': since, 'until': until, 'orders': count}
+    result.update((f'p{p}', float(value) if value is not None else None) for p, value in zip(percentiles, values))
+    return result
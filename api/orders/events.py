@@ -0,0 +1,47 @@
+import json
+from flask import current_app
+from ..utils.pubsub import create_broker
+
+
+def create_order_broker(app):
+    return create_broker(
+        app.config['ORDER_EVENTS_BROKER'],
+        maxsize=app.config['ORDER_EVENTS_QUEUE_SIZE'],
+        redis_url=app.config['ORDER_EVENTS_REDIS_URL'],
+        channel=app.config['ORDER_EVENTS_CHANNEL']
+    )
+
+
+def get_order_broker():
+    return current_app.extensions['order_events']
+
+
+def publish_status_changed(event):
+    """
+    Subscriber passing status_changed domain events on to the order broker
+    """
+    get_order_broker().publish(dict(event.payload, event='status_changed'))
+
+
+def register_order_subscribers(dispatcher):
+    dispatcher.subscribe('status_changed', publish_status_changed)
+
+
+def event_stream(subscription, heartbeat):
+    """
+    Server-Sent Events for a subscription, with a comment line every
+    heartbeat seconds of silence to keep proxies from closing the connection
+    """
+    try:
+        yield ': connected\n\n'
+        while True:
+            if subscription.overflowed and subscription.queue.empty():
+                yield 'event: overflow\ndata: {}\n\n'
+                return
+            message = subscription.get(timeout=heartbeat)
+            if message is None:
+                yield ': heartbeat\n\n'
+                continue
+            yield f"id: {message['id']}.{message['version']}\nevent: {message['event']}\ndata: {json.dumps(message)}\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from ..utils import db
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def stream_rows(statement, batch_size=1000):
+    """
+    Execute a select with a server-side cursor where the driver supports
+    it and yield its rows batch_size at a time
+    """
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def ndjson_chunks(batches, serializer):
+    for rows in batches:
+        yield ''.join(json.dumps(serializer.serialize(row)) + '\n' for row in rows)
+
+
+def csv_chunks(batches, serializer):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(serializer.model.keys())
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(serializer.serialize(row).values() for row in rows)
+        yield buffer.getvalue()
+
+
+def export_chunks(export_format, statement, serializer, batch_size=1000):
+    batches = stream_rows(statement, batch_size)
+    if export_format == 'csv':
+        return csv_chunks(batches, serializer)
+    return ndjson_chunks(batches, serializer)
@@ -0,0 +1,255 @@
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from ..models.orders import Order, OrderStatus
+from ..utils import db
+from ..utils.replicas import RoutingSession
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _name(value):
+    return getattr(value, 'name', value)
+
+
+class _Group:
+    """
+    Pending orders of one flavour and size, oldest first
+    """
+    def __init__(self):
+        self.orders = {}
+        self.heap = []
+        self.quantity = 0
+
+    def oldest(self):
+        while self.heap and self.orders.get(self.heap[0][1], (None,))[0] != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0]
+
+
+class KitchenQueue:
+    """
+    Pending orders grouped by (flavour, size) so identical pizzas bake
+    together. Groups sit in a heap ordered by the age of their oldest order,
+    advanced by batch_weight seconds for every pizza the next batch would
+    bake up to the oven capacity, so full batches go first unless a smaller
+    group has waited longer. Heaps drop stale entries lazily, so adding,
+    removing and taking orders are O(log n).
+    """
+    def __init__(self, capacity=8, batch_weight=60):
+        self.capacity = capacity
+        self.batch_weight = batch_weight
+        self.loaded_at = None
+        self.synced_at = None
+        self._groups = {}
+        self._index = {}
+        self._heap = []
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _priority(self, group):
+        return group.oldest() - self.batch_weight * min(group.quantity, self.capacity)
+
+    def _touch(self, key):
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        group = self._groups[key]
+        if group.orders:
+            heapq.heappush(self._heap, (self._priority(group), version, key))
+        if len(self._heap) > 4 * len(self._groups) + 16:
+            self._heap = [entry for entry in self._heap if self._versions[entry[2]] == entry[1]]
+            heapq.heapify(self._heap)
+
+    def _add(self, id, flavour, sizes, date_created, quantity):
+        self._remove(id)
+        key = (_name(flavour), _name(sizes))
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _Group()
+        created = (date_created - EPOCH).total_seconds()
+        group.orders[id] = (created, quantity or 1)
+        group.quantity += quantity or 1
+        heapq.heappush(group.heap, (created, id))
+        self._index[id] = key
+        self._touch(key)
+
+    def _remove(self, id):
+        key = self._index.pop(id, None)
+        if key is None:
+            return
+        group = self._groups[key]
+        group.quantity -= group.orders.pop(id)[1]
+        self._touch(key)
+
+    def add(self, id, flavour, sizes, date_created, quantity):
+        with self._lock:
+            self._add(id, flavour, sizes, date_created, quantity)
+
+    def remove(self, *ids):
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+
+    def load(self, rows):
+        """
+        Replace the queue with (id, flavour, sizes, date_created, quantity) rows
+        """
+        with self._lock:
+            self._groups, self._index, self._heap, self._versions = {}, {}, [], {}
+            for row in rows:
+                self._add(*row)
+            self.loaded_at = time.monotonic()
+
+    def sync(self, rows):
+        """
+        Apply (id, order_status, flavour, sizes, date_created, quantity) rows
+        of changed orders, keeping the pending ones and dropping the others
+        """
+        with self._lock:
+            for id, order_status, *values in rows:
+                if _name(order_status) == OrderStatus.PENDING.name:
+                    self._add(id, *values)
+                else:
+                    self._remove(id)
+            self.loaded_at = time.monotonic()
+
+    def next_batch(self, take=True):
+        """
+        (flavour, sizes, [order ids]) of the batch to bake next, oldest
+        orders first and up to capacity pizzas, or None when nothing is
+        pending. The orders leave the queue unless take is False.
+        """
+        with self._lock:
+            while self._heap and self._versions[self._heap[0][2]] != self._heap[0][1]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            key = self._heap[0][2]
+            group = self._groups[key]
+            ids, quantity = [], 0
+            taken = set()
+            while len(taken) < len(group.orders):
+                group.oldest()
+                id = group.heap[0][1]
+                if id in taken:
+                    # an order re-added with the same age has a second entry
+                    heapq.heappop(group.heap)
+                    continue
+                if ids and quantity + group.orders[id][1] > self.capacity:
+                    break
+                heapq.heappop(group.heap)
+                ids.append(id)
+                taken.add(id)
+                quantity += group.orders[id][1]
+            if take:
+                for id in ids:
+                    self._remove(id)
+            else:
+                for id in ids:
+                    heapq.heappush(group.heap, (group.orders[id][0], id))
+            return key[0], key[1], ids
+
+
+def create_kitchen_queue(app):
+    return KitchenQueue(capacity=app.config['KITCHEN_OVEN_CAPACITY'], batch_weight=app.config['KITCHEN_BATCH_WEIGHT'])
+
+
+def pending_rows():
+    return db.session.execute(
+        db.select(Order.id, Order.flavour, Order.sizes, Order.date_created, Order.quantity)
+        .where(Order.order_status == OrderStatus.PENDING)
+        .order_by(Order.date_created, Order.id)
+    )
+
+
+def changed_rows(since):
+    return db.session.execute(
+        db.select(Order.id, Order.order_status, Order.flavour, Order.sizes, Order.date_created, Order.quantity)
+        .where(Order.updated_at >= since)
+    )
+
+
+def get_kitchen_queue():
+    """
+    The kitchen queue of this process, loaded from the pending orders on
+    first use. Every KITCHEN_RESYNC_INTERVAL seconds it picks up orders
+    changed by other workers through the updated_at index, reading again
+    the last KITCHEN_RESYNC_OVERLAP seconds to catch transactions that
+    committed late or ran on a server with a skewed clock. Orders deleted
+    elsewhere stay queued until a claim finds them gone.
+    """
+    queue = current_app.extensions['kitchen_queue']
+    interval = current_app.config['KITCHEN_RESYNC_INTERVAL']
+    if queue.loaded_at is None:
+        synced_at = datetime.utcnow()
+        queue.load(pending_rows())
+        queue.synced_at = synced_at
+    elif interval > 0 and time.monotonic() - queue.loaded_at >= interval:
+        synced_at = datetime.utcnow()
+        queue.sync(changed_rows(queue.synced_at - timedelta(seconds=current_app.config['KITCHEN_RESYNC_OVERLAP'])))
+        queue.synced_at = synced_at
+    return queue
+
+
+def _loaded_queue():
+    if not has_app_context():
+        return None
+    queue = current_app.extensions['kitchen_queue']
+    return queue if queue.loaded_at is not None else None
+
+
+def queue_orders(orders):
+    """
+    Add committed orders that were inserted without the unit of work
+    """
+    queue = _loaded_queue()
+    for order in orders if queue is not None else ():
+        queue.add(order.id, order.flavour, order.sizes, order.date_created, order.quantity)
+
+
+def unqueue_orders(ids):
+    queue = _loaded_queue()
+    if queue is not None:
+        queue.remove(*ids)
+
+
+def _record(target, change):
+    if _loaded_queue() is not None:
+        db.inspect(target).session.info.setdefault('kitchen_changes', []).append(change)
+
+
+@db.event.listens_for(Order, 'after_insert')
+@db.event.listens_for(Order, 'after_update')
+def queue_order(mapper, connection, target):
+    if _name(target.order_status) == OrderStatus.PENDING.name:
+        _record(target, ('add', target.id, target.flavour, target.sizes, target.date_created, target.quantity))
+    else:
+        _record(target, ('remove', target.id))
+
+
+@db.event.listens_for(Order, 'after_delete')
+def unqueue_order(mapper, connection, target):
+    _record(target, ('remove', target.id))
+
+
+@db.event.listens_for(RoutingSession, 'after_commit')
+def apply_kitchen_changes(session):
+    changes = session.info.pop('kitchen_changes', None)
+    if not changes:
+        return
+    queue = current_app.extensions['kitchen_queue']
+    for action, id, *values in changes:
+        if action == 'add':
+            queue.add(id, *values)
+        else:
+            queue.remove(id)
+
+
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def discard_kitchen_changes(session):
+    session.info.pop('kitchen_changes', None)
@@ -1,13 +1,26 @@
-from flask_restx import Namespace, Resource, fields
-from ..models.orders import Order, OrderStatus
+from flask_restx import Namespace, Resource, fields, reqparse, inputs
+from ..models.orders import Order, OrderStatus, OrderStatusEvent, OrderFlavour, Sizes
 from http import HTTPStatus
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..models.users import User
+from flask_jwt_extended import jwt_required
 from ..utils import db
-from flask import request, abort
+from ..utils.replicas import use_replica
+from ..utils.conditional import conditional
+from ..utils.idempotency import idempotent
+from ..utils.serializer import Serializer, serialize_with, register_enums
+from .events import get_order_broker, event_stream
+from .export import EXPORT_FORMATS, export_chunks
+from .analytics import order_summary, status_percentiles
+from .kitchen import get_kitchen_queue, queue_orders, unqueue_orders
+from ..utils.pagination import keyset_paginate, page_limit
+from ..utils.identity import current_user_id, current_user_is_staff
+from flask import request, abort, current_app, Response, stream_with_context
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime, timedelta, timezone
 
 order_namespace = Namespace('orders', 'Namespace for order')
 
+register_enums(Sizes, OrderStatus, OrderFlavour)
+
 place_order_model = order_namespace.model(
     'order', {
         'flavour': fields.String(required=True, description='Pizza flavour')
@@ -20,6 +33,8 @@ order_model = order_namespace.model(
         'order_status': fields.String(description='Status of the order', enum=['PENDING', 'IN_TRANSIT', 'DELIVERED']),
         'flavour': fields.String(description='Pizza flavour', enum=['BBQ_CHICKEN', 'PEPPERONI', 'SAUSAGE', 'CHEESE', 'EXTRA_CHEESE', 'BACON', 'PINEAPPLE', 'MARGHERITA' ]),
         'quantity': fields.Integer(description='Quantity of order'),
+        'unit_price': fields.Fixed(decimals=2, description='Price of one pizza when the order was placed or last changed'),
+        'total': fields.Fixed(decimals=2, description='unit_price times quantity'),
         'date_created': fields.DateTime(description='Time order was placed'),
         'customer': fields.Integer()
     }
@@ -38,20 +53,258 @@ update_order_status_model = order_namespace.model(
     }
 )
 
+bulk_status_filter_model = order_namespace.model(
+    'bulk_status_filter', {
+        'order_status': fields.String(description='Current status of the order', enum=[status.name for status in OrderStatus]),
+        'flavour': fields.String(description='Pizza flavour', enum=[flavour.name for flavour in OrderFlavour]),
+        'sizes': fields.String(description='The size of pizza order', enum=[size.name for size in Sizes]),
+        'customer': fields.Integer(description='The customer id'),
+        'created_after': fields.DateTime(description='Orders placed at or after this time'),
+        'created_before': fields.DateTime(description='Orders placed before this time')
+    }
+)
+bulk_status_model = order_namespace.model(
+    'bulk_status', {
+        'order_status': fields.String(required=True, description='New status of the orders', enum=[status.name for status in OrderStatus]),
+        'ids': fields.List(fields.Integer, description='Ids of the orders to update'),
+        'filter': fields.Nested(bulk_status_filter_model, description='Update the orders matching this filter instead of a list of ids')
+    }
+)
+bulk_status_item_model = order_namespace.model(
+    'bulk_status_item', {
+        'id': fields.Integer(description='The order id'),
+        'result': fields.String(description='What happened to the order', enum=['updated', 'unchanged', 'invalid_transition', 'not_found'])
+    }
+)
+bulk_status_result_model = order_namespace.model(
+    'bulk_status_result', {
+        'order_status': fields.String(description='New status of the orders'),
+        'results': fields.List(fields.Nested(bulk_status_item_model), description='Outcome for each order')
+    }
+)
+
+batch_order_item_model = order_namespace.model(
+    'batch_order_item', {
+        'flavour': fields.String(required=True, description='Pizza flavour', enum=[flavour.name for flavour in OrderFlavour]),
+        'sizes': fields.String(description='The size of pizza order', enum=[size.name for size in Sizes]),
+        'quantity': fields.Integer(description='Quantity of order', min=1)
+    }
+)
+batch_order_model = order_namespace.model(
+    'batch_order', {
+        'orders': fields.List(fields.Nested(batch_order_item_model), required=True, description='Orders to place'),
+        'allow_partial': fields.Boolean(description='Place the valid orders even if some are invalid', default=False)
+    }
+)
+batch_error_model = order_namespace.model(
+    'batch_order_error', {
+        'index': fields.Integer(description='Position of the invalid order in the request'),
+        'message': fields.String(description='Why the order was rejected')
+    }
+)
+batch_result_model = order_namespace.model(
+    'batch_order_result', {
+        'orders': fields.List(fields.Nested(order_model), description='Orders placed'),
+        'errors': fields.List(fields.Nested(batch_error_model), description='Orders rejected')
+    }
+)
+
+order_list_parser = reqparse.RequestParser()
+order_list_parser.add_argument('limit', type=int, location='args', help='Maximum number of orders to return')
+order_list_parser.add_argument('cursor', type=str, location='args', help='Value of the X-Next-Cursor header of the previous page')
+order_list_parser.add_argument('order_status', type=str, location='args', choices=[status.name for status in OrderStatus])
+order_list_parser.add_argument('flavour', type=str, location='args', choices=[flavour.name for flavour in OrderFlavour])
+order_list_parser.add_argument('sizes', type=str, location='args', choices=[size.name for size in Sizes])
+order_list_parser.add_argument('customer', type=int, location='args', help='The customer id')
+order_list_parser.add_argument('created_after', type=inputs.datetime_from_iso8601, location='args')
+order_list_parser.add_argument('created_before', type=inputs.datetime_from_iso8601, location='args')
+
+
+def validate_order_item(item):
+    """
+    Return the column values for one item of a batch order or raise ValueError
+    """
+    if not isinstance(item, dict):
+        raise ValueError('Order must be an object')
+    if item.get('flavour') not in OrderFlavour.__members__:
+        raise ValueError(f"Invalid flavour {item.get('flavour')!r}")
+    sizes = item.get('sizes') or Sizes.SMALL.name
+    if sizes not in Sizes.__members__:
+        raise ValueError(f'Invalid size {sizes!r}')
+    quantity = item.get('quantity', 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        raise ValueError(f'Invalid quantity {quantity!r}')
+    return {
+        'flavour': OrderFlavour[item['flavour']],
+        'sizes': Sizes[sizes],
+        'quantity': quantity
+    }
+
+summary_bucket_model = order_namespace.model(
+    'summary_bucket', {
+        'key': fields.Raw(description='Flavour, size, status, day or customer id of the bucket'),
+        'orders': fields.Integer(description='Number of orders'),
+        'quantity': fields.Integer(description='Total quantity ordered'),
+        'revenue': fields.Fixed(decimals=2, description='Sum of order totals')
+    }
+)
+
+summary_model = order_namespace.model(
+    'order_summary', {
+        'orders': fields.Integer(description='Number of orders'),
+        'quantity': fields.Integer(description='Total quantity ordered'),
+        'revenue': fields.Fixed(decimals=2, description='Sum of order totals'),
+        'flavour': fields.List(fields.Nested(summary_bucket_model)),
+        'sizes': fields.List(fields.Nested(summary_bucket_model)),
+        'order_status': fields.List(fields.Nested(summary_bucket_model)),
+        'day': fields.List(fields.Nested(summary_bucket_model)),
+        'customer': fields.List(fields.Nested(summary_bucket_model))
+    }
+)
+
+kitchen_batch_model = order_namespace.model(
+    'kitchen_batch', {
+        'flavour': fields.String(description='Pizza flavour of every order in the batch'),
+        'sizes': fields.String(description='Pizza size of every order in the batch'),
+        'quantity': fields.Integer(description='Number of pizzas to bake'),
+        'orders': fields.List(fields.Nested(order_model), description='Orders in the batch, oldest first')
+    }
+)
+
+status_event_model = order_namespace.model(
+    'order_status_event', {
+        'order_status': fields.String(description='Status the order moved to', enum=[status.name for status in OrderStatus]),
+        'at': fields.DateTime(description='Time of the change')
+    }
+)
+
+order_timeline_model = order_namespace.model(
+    'order_timeline', {
+        'id': fields.Integer(description='The order id'),
+        'events': fields.List(fields.Nested(status_event_model), description='Status changes, oldest first')
+    }
+)
+
+status_times_model = order_namespace.model(
+    'order_status_times', {
+        'order_status': fields.String(description='Status reached', enum=[status.name for status in OrderStatus]),
+        'since': fields.DateTime(description='Start of the window'),
+        'until': fields.DateTime(description='End of the window'),
+        'orders': fields.Integer(description='Orders that reached the status in the window'),
+        'p50': fields.Float(description='Median seconds from placement to the status'),
+        'p95': fields.Float(description='95th percentile seconds from placement to the status')
+    }
+)
+
+order_summary_parser = reqparse.RequestParser()
+order_summary_parser.add_argument('created_after', type=inputs.date_from_iso8601, location='args', help='First day to include')
+order_summary_parser.add_argument('created_before', type=inputs.date_from_iso8601, location='args', help='Last day to include')
+
+order_export_parser = reqparse.RequestParser()
+order_export_parser.add_argument('format', type=str, location='args', choices=list(EXPORT_FORMATS), default='ndjson')
+order_export_parser.add_argument('order_status', type=str, location='args', choices=[status.name for status in OrderStatus])
+order_export_parser.add_argument('created_after', type=inputs.datetime_from_iso8601, location='args')
+order_export_parser.add_argument('created_before', type=inputs.datetime_from_iso8601, location='args')
+
+status_times_parser = reqparse.RequestParser()
+status_times_parser.add_argument('order_status', type=str, location='args', choices=[status.name for status in OrderStatus if status != OrderStatus.PENDING], default=OrderStatus.DELIVERED.name)
+status_times_parser.add_argument('since', type=inputs.datetime_from_iso8601, location='args', help='Start of the window, a day before until by default')
+status_times_parser.add_argument('until', type=inputs.datetime_from_iso8601, location='args', help='End of the window, now by default')
+
+order_serializer = Serializer(order_model)
+
+
+def order_validators(resource, order_id):
+    current = Order.validators(order_id)
+    if current is None:
+        return None
+    return f'{order_id}.{current.version}', current.updated_at
+
+
+def commit_order_change():
+    """
+    Commit a change to a loaded order, or abort with 409 when another
+    request changed the order since it was read
+    """
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        abort(409, 'The order was changed by another request, fetch it and try again')
+
+
+def parse_order_filter(data):
+    """
+    Validate a filter sent in a request body into the arguments taken by order_filters
+    """
+    if not isinstance(data, dict) or not data:
+        abort(400, 'filter must be an object with at least one criterion')
+    args = {}
+    for key, enum in (('order_status', OrderStatus), ('flavour', OrderFlavour), ('sizes', Sizes)):
+        if data.get(key) is not None:
+            if data[key] not in enum.__members__:
+                abort(400, f'Invalid {key} {data[key]!r}')
+            args[key] = data[key]
+    if data.get('customer') is not None:
+        if not isinstance(data['customer'], int) or isinstance(data['customer'], bool):
+            abort(400, 'customer must be an integer')
+        args['customer'] = data['customer']
+    for key in ('created_after', 'created_before'):
+        if data.get(key):
+            try:
+                args[key] = inputs.datetime_from_iso8601(data[key])
+            except ValueError:
+                abort(400, f'Invalid {key} {data[key]!r}')
+    return args
+
+
+def naive_utc(value):
+    """
+    value as the naive UTC datetime stored in the database
+    """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def order_filters(args):
+    criteria = []
+    if args.get('order_status'):
+        criteria.append(Order.order_status == OrderStatus[args['order_status']])
+    if args.get('flavour'):
+        criteria.append(Order.flavour == OrderFlavour[args['flavour']])
+    if args.get('sizes'):
+        criteria.append(Order.sizes == Sizes[args['sizes']])
+    if args.get('customer') is not None:
+        criteria.append(Order.customer == args['customer'])
+    if args.get('created_after'):
+        criteria.append(Order.date_created >= naive_utc(args['created_after']))
+    if args.get('created_before'):
+        criteria.append(Order.date_created < naive_utc(args['created_before']))
+    return criteria
+
+
 @order_namespace.route('/orders')
 class Orders(Resource):
-    @order_namespace.marshal_with(order_model)
-    @order_namespace.doc(description="Get all orders")
+    @order_namespace.expect(order_list_parser)
+    @serialize_with(order_model, as_list=True)
+    @order_namespace.doc(description="Get a page of orders. The cursor for the next page is returned in the X-Next-Cursor header")
     @jwt_required()
+    @use_replica
     def get(self):
         """
         Get all orders
         """
-        orders = Order.query.all()
-        return orders, HTTPStatus.OK
+        args = order_list_parser.parse_args()
+        statement = Order.select_rows(*order_filters(args))
+        orders, next_cursor = keyset_paginate(statement, Order.date_created, Order.id, args.get('cursor'), page_limit(args.get('limit')))
+
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return orders, HTTPStatus.OK, headers
 
 
     @order_namespace.expect(place_order_model)
+    @idempotent
     @order_namespace.marshal_with(order_model)
     @order_namespace.doc(description="Place an order")
     @jwt_required()
@@ -59,26 +312,193 @@ class Orders(Resource):
         """
         Place an order
         """
-        user_name = get_jwt_identity()
-        current_user = User.query.filter_by(username=user_name).first()
         data = order_namespace.payload #NOTE
         new_order = Order(
-            flavour=data['flavour']
+            flavour=data['flavour'],
+            customer=current_user_id()
         )
-        new_order.user = current_user
         new_order.save()
         return new_order, HTTPStatus.CREATED #NOTE???? Wrong Enum
 
 
+@order_namespace.route('/orders/batch')
+class BatchOrders(Resource):
+    @order_namespace.expect(batch_order_model)
+    @order_namespace.marshal_with(batch_result_model)
+    @order_namespace.doc(description="Place several orders in a single transaction")
+    @jwt_required()
+    def post(self):
+        """
+        Place several orders
+        """
+        data = order_namespace.payload or {}
+        items = data.get('orders')
+        if not isinstance(items, list) or not items:
+            abort(400, 'orders must be a non-empty list')
+        if len(items) > current_app.config['ORDERS_MAX_BATCH_SIZE']:
+            abort(400, f"At most {current_app.config['ORDERS_MAX_BATCH_SIZE']} orders can be placed at once")
+
+        customer = current_user_id()
+        rows, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                rows.append(dict(validate_order_item(item), customer=customer))
+            except ValueError as error:
+                errors.append({'index': index, 'message': str(error)})
+
+        if errors and not data.get('allow_partial'):
+            return {'orders': [], 'errors': errors}, HTTPStatus.BAD_REQUEST
+        orders = Order.bulk_create(rows) if rows else []
+        queue_orders(orders)
+        return {'orders': orders, 'errors': errors}, HTTPStatus.CREATED
+
+
+@order_namespace.route('/orders/export')
+class ExportOrders(Resource):
+    @order_namespace.expect(order_export_parser)
+    @order_namespace.produces(list(EXPORT_FORMATS.values()))
+    @order_namespace.doc(description="Stream all orders matching the filters as NDJSON or CSV. Only staff can access this route")
+    @jwt_required()
+    @use_replica
+    def get(self):
+        """
+        Export orders
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        args = order_export_parser.parse_args()
+        statement = Order.select_rows(*order_filters(args)).order_by(Order.date_created, Order.id)
+        chunks = export_chunks(args['format'], statement, order_serializer, current_app.config['ORDERS_EXPORT_BATCH_SIZE'])
+        return Response(
+            stream_with_context(chunks),
+            mimetype=EXPORT_FORMATS[args['format']],
+            headers={'Content-Disposition': f"attachment; filename=orders.{args['format']}"}
+        )
+
+
+@order_namespace.route('/orders/summary')
+class OrderSummary(Resource):
+    @order_namespace.expect(order_summary_parser)
+    @order_namespace.marshal_with(summary_model)
+    @order_namespace.doc(description="Order counts and quantities by flavour, size, status, day and customer. Only staff can access this route")
+    @jwt_required()
+    @use_replica
+    def get(self):
+        """
+        Summarize orders
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        args = order_summary_parser.parse_args()
+        return order_summary(args['created_after'], args['created_before']), HTTPStatus.OK
+
+
+@order_namespace.route('/orders/status-times')
+class OrderStatusTimes(Resource):
+    @order_namespace.expect(status_times_parser)
+    @order_namespace.marshal_with(status_times_model)
+    @order_namespace.doc(description="p50 and p95 time from placement to IN_TRANSIT or DELIVERED for orders that reached it in a window. Only staff can access this route")
+    @jwt_required()
+    @use_replica
+    def get(self):
+        """
+        Percentiles of order status times
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        args = status_times_parser.parse_args()
+        until = naive_utc(args['until']) or datetime.utcnow()
+        since = naive_utc(args['since']) or until - timedelta(days=1)
+        if since >= until:
+            abort(400, 'since must be before until')
+        return status_percentiles(OrderStatus[args['order_status']], since, until), HTTPStatus.OK
+
+
+@order_namespace.route('/kitchen/next-batch')
+class KitchenNextBatch(Resource):
+    def batch(self, flavour, sizes, ids):
+        orders = db.session.execute(Order.select_rows(Order.id.in_(ids)).order_by(Order.date_created, Order.id)).all()
+        return {
+            'flavour': flavour,
+            'sizes': sizes,
+            'quantity': sum(order.quantity or 0 for order in orders),
+            'orders': orders
+        }
+
+    @order_namespace.marshal_with(kitchen_batch_model)
+    @order_namespace.response(HTTPStatus.NO_CONTENT, 'No pending orders')
+    @order_namespace.doc(description="Show the pending orders the kitchen should bake next. Only staff can access this route")
+    @jwt_required()
+    def get(self):
+        """
+        Peek at the next kitchen batch
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        batch = get_kitchen_queue().next_batch(take=False)
+        if batch is None:
+            return None, HTTPStatus.NO_CONTENT
+        return self.batch(*batch), HTTPStatus.OK
+
+    @order_namespace.marshal_with(kitchen_batch_model)
+    @order_namespace.response(HTTPStatus.NO_CONTENT, 'No pending orders')
+    @order_namespace.doc(description="Take the next kitchen batch and move its orders to IN_TRANSIT. Only staff can access this route")
+    @jwt_required()
+    def post(self):
+        """
+        Take the next kitchen batch
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        queue = get_kitchen_queue()
+        while True:
+            batch = queue.next_batch()
+            if batch is None:
+                return None, HTTPStatus.NO_CONTENT
+            flavour, sizes, ids = batch
+            rows = Order.bulk_update_status(OrderStatus.IN_TRANSIT, ids=ids)
+            # orders another worker already moved are dropped from the batch
+            if rows:
+                return self.batch(flavour, sizes, [id for id, customer, version in rows]), HTTPStatus.OK
+
+
+@order_namespace.route('/orders/events')
+class OrderEvents(Resource):
+    @order_namespace.produces(['text/event-stream'])
+    @order_namespace.doc(description="Stream order status changes as Server-Sent Events. Staff receive every order, other users only their own")
+    @jwt_required()
+    def get(self):
+        """
+        Stream order status changes
+        """
+        if current_user_is_staff():
+            predicate = None
+        else:
+            user_id = current_user_id()
+            predicate = lambda message: user_id is not None and message['customer'] == user_id
+        subscription = get_order_broker().subscribe(predicate)
+        stream = event_stream(subscription, current_app.config['ORDER_EVENTS_HEARTBEAT'])
+        # the stream needs no request context, so an idle client must not
+        # keep the connection the identity lookups checked out
+        db.session.remove()
+        return Response(
+            stream,
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+
 @order_namespace.route('/order/<int:order_id>')
 class OrderById(Resource):
-    @order_namespace.marshal_with(order_model)
-    @order_namespace.doc(description="Retrieve an order by it's id",
+    @jwt_required()
+    @use_replica
+    @conditional(order_validators)
+    @serialize_with(order_model)
+    @order_namespace.doc(description="Retrieve an order by it's id. Supports If-None-Match and If-Modified-Since",
                             params= {
                                 'order_id': "The order id"
                             }
     )
-    @jwt_required()
     def get(self, order_id):
         """
         Get an order by id
@@ -88,6 +508,7 @@ class OrderById(Resource):
         
 
     @order_namespace.expect(update_order_model)
+    @idempotent
     @order_namespace.marshal_with(order_model)
     @order_namespace.doc(description="Update an order with id",
                             params= {
@@ -101,15 +522,14 @@ class OrderById(Resource):
         """
         order_to_update = Order.get_by_id(order_id)
         data = order_namespace.payload
-        identity = get_jwt_identity()
-        current_user = User.query.filter_by(id=order_to_update.customer).first()
+        user_id = current_user_id()
 
-        if (identity == current_user.username):
+        if user_id is not None and order_to_update.customer == user_id:
             order_to_update.sizes = data['sizes']
             order_to_update.flavour = data['flavour']
             order_to_update.quantity = data['quantity']
 
-            db.session.commit()
+            commit_order_change()
             return order_to_update, HTTPStatus.OK
 
     @jwt_required()
@@ -122,11 +542,10 @@ class OrderById(Resource):
         """
         Delete an order
         """
-        identity = get_jwt_identity()
         order_to_delete = Order.get_by_id(order_id)
-        current_user = User.query.filter_by(id=order_to_delete.customer).first()
+        user_id = current_user_id()
 
-        if (identity == current_user.username):
+        if user_id is not None and order_to_delete.customer == user_id:
             if order_to_delete.order_status != OrderStatus.PENDING:
                 abort(404, 'Order already in production')
             order_to_delete.delete_by_id()
@@ -134,6 +553,28 @@ class OrderById(Resource):
         return {"message": "Not allowed"}, HTTPStatus.FORBIDDEN
 
 
+@order_namespace.route('/order/<int:order_id>/timeline')
+class OrderTimeline(Resource):
+    @order_namespace.marshal_with(order_timeline_model)
+    @order_namespace.doc(description="Status history of an order. Staff can see any order, other users only their own",
+                            params= {
+                                'order_id': "The order id"
+                            }
+    )
+    @jwt_required()
+    @use_replica
+    def get(self, order_id):
+        """
+        Get the status timeline of an order
+        """
+        order = Order.get_by_id(order_id)
+        user_id = current_user_id()
+        if not current_user_is_staff() and (user_id is None or order.customer != user_id):
+            abort(403, 'Not allowed')
+        events = [{'order_status': status.name, 'at': at} for status, at in OrderStatusEvent.timeline(order_id)]
+        return {'id': order_id, 'events': events}, HTTPStatus.OK
+
+
 @order_namespace.route('/order/<int:order_id>/status')
 @order_namespace.doc(description="Update order status by id",
                         params= {
@@ -148,12 +589,65 @@ class UpdateOrderStatus(Resource):
         """
         Update an order status
         """
-        identity = get_jwt_identity()
-        user = User.query.filter_by(username=identity).first()
-        if user.is_staff:
+        if current_user_is_staff():
             order_to_update = Order.get_by_id(order_id)
             data = order_namespace.payload
-            order_to_update.order_status = data['order_status']
-            
-            db.session.commit()
+            if data.get('order_status') not in OrderStatus.__members__:
+                abort(400, f"Invalid order_status {data.get('order_status')!r}")
+            order_status = OrderStatus[data['order_status']]
+            if order_to_update.order_status != order_status:
+                order_to_update.order_status = order_status
+                commit_order_change()
             return order_to_update, HTTPStatus.OK
+
+
+@order_namespace.route('/orders/status')
+class BulkUpdateOrderStatus(Resource):
+    @jwt_required()
+    @order_namespace.expect(bulk_status_model)
+    @order_namespace.marshal_with(bulk_status_result_model)
+    @order_namespace.doc(description="Move several orders to a new status. Orders can only move forward from PENDING to IN_TRANSIT to DELIVERED. Only staff can access this route")
+    def patch(self):
+        """
+        Update the status of several orders
+        """
+        if not current_user_is_staff():
+            abort(403, 'Staff privilege only')
+        data = order_namespace.payload or {}
+        if data.get('order_status') not in OrderStatus.__members__:
+            abort(400, f"Invalid order_status {data.get('order_status')!r}")
+        order_status = OrderStatus[data['order_status']]
+        ids = data.get('ids')
+        if (ids is None) == (data.get('filter') is None):
+            abort(400, 'Provide either ids or filter')
+
+        if ids is None:
+            criteria = order_filters(parse_order_filter(data['filter']))
+            updated = Order.bulk_update_status(order_status, criteria=criteria)
+            unqueue_orders(id for id, customer, version in updated)
+            results = [{'id': id, 'result': 'updated'} for id, customer, version in updated]
+            return {'order_status': order_status.name, 'results': results}, HTTPStatus.OK
+
+        if not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+            abort(400, 'ids must be a list of integers')
+        if len(ids) > current_app.config['ORDERS_MAX_BATCH_SIZE']:
+            abort(400, f"At most {current_app.config['ORDERS_MAX_BATCH_SIZE']} orders can be updated at once")
+        ids = list(dict.fromkeys(ids))
+        rows = Order.bulk_update_status(order_status, ids=ids)
+        unqueue_orders(id for id, customer, version in rows)
+        updated = {id for id, customer, version in rows}
+        remaining = [id for id in ids if id not in updated]
+        current = dict(db.session.query(Order.id, Order.order_status).filter(Order.id.in_(remaining))) if remaining else {}
+
+        results = []
+        for id in ids:
+            if id in updated:
+                result = 'updated'
+            elif id not in current:
+                result = 'not_found'
+            elif current[id] == order_status:
+                result = 'unchanged'
+            else:
+                result = 'invalid_transition'
+            results.append({'id': id, 'result': result})
+        return {'order_status': order_status.name, 'results': results}, HTTPStatus.OK
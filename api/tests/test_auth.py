@@ -2,9 +2,13 @@ import unittest
 from .. import create_app
 from ..utils import db
 from ..config import config_dict
-from werkzeug.security import generate_password_hash, check_password_hash
+from ..utils.passwords import PasswordHasher
 from ..models.users import User
-from flask_jwt_extended import create_access_token, create_refresh_token
+from ..models.blocklist import TokenBlocklist
+from datetime import datetime, timedelta
+from ..utils.revocation import BloomFilterRevocationStore, CachedRevocationStore, DatabaseRevocationStore, KeyValueRevocationStore, MemoryKeyValueClient
+import time
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
 
 
 class AuthenticationTestCase(unittest.TestCase):
@@ -37,6 +41,26 @@ class AuthenticationTestCase(unittest.TestCase):
 
         assert response.status_code == 201
 
+    def test_signup_conflict_names_field(self):
+        data = {
+            "username": "testuser",
+            "email": "testuser@gmail.com",
+            "password": "password"
+            }
+        self.client.post('/auth/signup', json=data)
+
+        response = self.client.post('/auth/signup', json=dict(data, username="other", email="TestUser@gmail.com"))
+        assert response.status_code == 409
+        assert response.json['field'] == 'email'
+
+        response = self.client.post('/auth/signup', json=dict(data, email="other@gmail.com"))
+        assert response.status_code == 409
+        assert response.json['field'] == 'username'
+        assert User.query.count() == 1
+
+        response = self.client.post('/auth/login', json={"email": "TESTUSER@gmail.com", "password": "password"})
+        assert response.status_code == 201
+
 
     def test_user_login(self):
         data = {
@@ -49,6 +73,76 @@ class AuthenticationTestCase(unittest.TestCase):
         assert response.status_code == 200
 
 
+    def test_login_token_carries_user_claims(self):
+        data = {
+            "username": "testuser",
+            "email": "testuser@gmail.com",
+            "password": "password"
+            }
+        self.client.post('/auth/signup', json=data)
+        response = self.client.post('/auth/login', json={"email": "testuser@gmail.com", "password": "password"})
+
+        claims = decode_token(response.json["access_token"])
+        assert claims["sub"] == "testuser"
+        assert claims["user_id"] == 1
+        assert claims["is_staff"] is False
+        assert claims["app_admin"] is False
+
+
+    def test_login_rehashes_outdated_password(self):
+        data = {
+            "username": "testuser",
+            "email": "testuser@gmail.com",
+            "password": "password"
+            }
+        self.client.post('/auth/signup', json=data)
+        user = User.query.filter_by(email="testuser@gmail.com").first()
+        assert user.password.startswith('pbkdf2:sha256:1000$')
+
+        self.app.extensions['password_hasher'] = PasswordHasher('pbkdf2:sha256:2000', executor='thread', workers=2)
+        response = self.client.post('/auth/login', json={"email": "testuser@gmail.com", "password": "password"})
+        assert response.status_code == 201
+        assert user.password.startswith('pbkdf2:sha256:2000$')
+
+        response = self.client.post('/auth/login', json={"email": "testuser@gmail.com", "password": "wrong"})
+        assert response.status_code == 200
+        self.app.extensions['password_hasher'].shutdown()
+
+    def test_login_rate_limited_per_account(self):
+        self.app.config['RATE_LIMIT_LOGIN_PER_ACCOUNT'] = '2/minute'
+        data = {"email": "victim@gmail.com", "password": "wrong"}
+
+        for _ in range(2):
+            response = self.client.post('/auth/login', json=data)
+            assert response.status_code == 200
+
+        response = self.client.post('/auth/login', json=dict(data, email="VICTIM@gmail.com"))
+        assert response.status_code == 429
+        assert 0 < int(response.headers['Retry-After']) <= 30
+
+        response = self.client.post('/auth/login', json=dict(data, email="other@gmail.com"))
+        assert response.status_code == 200
+
+    def test_auth_rate_limited_per_forwarded_address(self):
+        class ProxiedConfig(config_dict['test']):
+            PROXY_FIX_X_FOR = 1
+            RATE_LIMIT_AUTH_PER_IP = '1/minute'
+
+        app = create_app(config=ProxiedConfig)
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            data = {"email": "someone@gmail.com", "password": "wrong"}
+
+            # every request arrives from the router's address
+            response = client.post('/auth/login', json=data, headers={'X-Forwarded-For': '203.0.113.1'})
+            assert response.status_code == 200
+            response = client.post('/auth/login', json=data, headers={'X-Forwarded-For': '203.0.113.2'})
+            assert response.status_code == 200
+            response = client.post('/auth/login', json=data, headers={'X-Forwarded-For': '198.51.100.9, 203.0.113.1'})
+            assert response.status_code == 429
+            db.drop_all()
+
     def test_user_logout(self):
         token = create_access_token(identity="testuser", fresh=True)
 
@@ -69,3 +163,58 @@ class AuthenticationTestCase(unittest.TestCase):
         response = self.client.post('auth/refresh', headers=header)
         assert response.status_code == 200
 
+    def test_logged_out_token_is_rejected(self):
+        token = create_access_token(identity="testuser", fresh=True)
+        header = {
+            "Authorization": f"Bearer {token}"
+        }
+
+        response = self.client.get('/orders/orders', headers=header)
+        assert response.status_code == 200
+
+        response = self.client.delete('auth/logout', headers=header)
+        assert response.status_code == 200
+
+        response = self.client.get('/orders/orders', headers=header)
+        assert response.status_code == 401
+
+    def test_bloom_filter_revocation_store(self):
+        store = BloomFilterRevocationStore(DatabaseRevocationStore(), capacity=100)
+        store.revoke("revoked-jti")
+
+        assert store.is_revoked("revoked-jti")
+        assert not store.is_revoked("other-jti")
+
+    def test_cached_revocation_rechecks_unrevoked_tokens(self):
+        backend = DatabaseRevocationStore()
+        store = CachedRevocationStore(backend, negative_ttl=0)
+        assert not store.is_revoked("jti", exp=time.time() + 1800)
+
+        # a logout handled by another worker goes straight to the backend
+        backend.revoke("jti", exp=time.time() + 1800)
+        assert store.is_revoked("jti", exp=time.time() + 1800)
+
+    def test_key_value_revocation_expires_with_token(self):
+        client = MemoryKeyValueClient()
+        store = KeyValueRevocationStore(client)
+        store.revoke("revoked-jti", exp=time.time() + 120)
+
+        assert store.is_revoked("revoked-jti")
+        assert not store.is_revoked("other-jti")
+        assert 110 < client.ttl("revoked:revoked-jti") <= 120
+        assert list(store.revoked_jtis()) == ["revoked-jti"]
+
+    def test_purge_expired_tokens(self):
+        now = datetime.utcnow()
+        db.session.add_all([
+            TokenBlocklist(jti="expired-1", created_at=now - timedelta(hours=2), expires_at=now - timedelta(hours=1)),
+            TokenBlocklist(jti="expired-2", created_at=now - timedelta(hours=2), expires_at=now - timedelta(minutes=1)),
+            TokenBlocklist(jti="legacy", created_at=now - timedelta(days=1)),
+            TokenBlocklist(jti="active", created_at=now, expires_at=now + timedelta(minutes=30))
+        ])
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=["blocklist", "purge", "--batch-size", "2"])
+
+        assert "Deleted 3 expired tokens" in result.output
+        assert [token.jti for token in TokenBlocklist.query.all()] == ["active"]
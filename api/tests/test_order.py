@@ -1,9 +1,31 @@
+import csv
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from .. import create_app
 from ..utils import db
 from ..config import config_dict
-from ..models.orders import Order
+from ..models.orders import Order, OrderFlavour, OrderRollup, OrderStatus, OrderStatusEvent, Sizes
+from ..orders.analytics import compute_summary
 from ..models.users import User
+from ..orders.views import order_model, summary_model
+from ..user.views import user_model
+from ..utils.serializer import Serializer
+from ..utils.idempotency import idempotency_key, get_idempotency_store
+from ..utils.pricing import PriceBook
+from ..utils.dispatch import DomainEvent, EventDispatcher, get_event_dispatcher
+from ..utils.replicas import RecentWriters
+from ..models.outbox import OutboxEvent
+from ..models.idempotency import IdempotencyKey
+from flask_restx import marshal
+from sqlalchemy.orm.exc import StaleDataError
 from flask_jwt_extended import create_access_token
 
 
@@ -117,3 +139,565 @@ class OrderTestCase(unittest.TestCase):
         response = self.client.patch('/orders/order/1/status', headers=header, json=data)
         assert response.status_code == 200
         assert response.json['order_status'] == 'OrderStatus.DELIVERED'
+
+
+    def test_concurrent_status_change_conflicts(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+
+        def concurrent_update(mapper, connection, target):
+            # SQLite cannot verify the version of updated rows, so fail the
+            # flush the way PostgreSQL does after another request moved the order
+            raise StaleDataError('UPDATE statement on table orders expected to update 1 row(s); 0 were matched.')
+
+        db.event.listen(Order, 'before_update', concurrent_update)
+        try:
+            response = self.client.patch('/orders/order/1/status', headers=header, json={'order_status': "IN_TRANSIT"})
+        finally:
+            db.event.remove(Order, 'before_update', concurrent_update)
+        assert response.status_code == 409
+
+    def test_get_orders_paginated(self):
+        token = create_access_token(identity="testuser")
+        header = {
+            "Authorization": f"Bearer {token}"
+        }
+        for flavour in ["BACON", "CHEESE", "BACON"]:
+            self.client.post('/orders/orders', headers=header, json={'flavour': flavour})
+
+        response = self.client.get('/orders/orders?limit=2', headers=header)
+        assert response.status_code == 200
+        assert [order['id'] for order in response.json] == [1, 2]
+
+        cursor = response.headers['X-Next-Cursor']
+        response = self.client.get(f'/orders/orders?limit=2&cursor={cursor}', headers=header)
+        assert [order['id'] for order in response.json] == [3]
+        assert 'X-Next-Cursor' not in response.headers
+
+        response = self.client.get('/orders/orders?flavour=BACON', headers=header)
+        assert [order['id'] for order in response.json] == [1, 3]
+
+        # bounds with an offset are compared in UTC
+        placed = db.session.get(Order, 2).date_created.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=2)))
+        response = self.client.get('/orders/orders', headers=header, query_string={'created_after': placed.isoformat()})
+        assert [order['id'] for order in response.json] == [2, 3]
+        response = self.client.get('/orders/orders', headers=header, query_string={'created_before': placed.isoformat()})
+        assert [order['id'] for order in response.json] == [1]
+
+    def test_create_orders_in_batch(self):
+        token = create_access_token(identity="testuser")
+        header = {
+            "Authorization": f"Bearer {token}"
+        }
+        data = {
+            'orders': [
+                {'flavour': "BACON", 'sizes': "LARGE", 'quantity': 2},
+                {'flavour': "NOT_A_FLAVOUR"},
+                {'flavour': "CHEESE"}
+            ]
+        }
+
+        response = self.client.post('/orders/orders/batch', headers=header, json=data)
+        assert response.status_code == 400
+        assert response.json['errors'][0]['index'] == 1
+        assert Order.query.count() == 0
+
+        data['allow_partial'] = True
+        response = self.client.post('/orders/orders/batch', headers=header, json=data)
+        assert response.status_code == 201
+        assert [order['flavour'] for order in response.json['orders']] == ['OrderFlavour.BACON', 'OrderFlavour.CHEESE']
+        assert response.json['orders'][0]['sizes'] == 'Sizes.LARGE'
+        assert response.json['orders'][0]['quantity'] == 2
+        assert Order.query.count() == 2
+
+    def test_create_orders_in_batch_statements(self):
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}"
+        }
+        statements = []
+
+        def record_statement(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', record_statement)
+        try:
+            response = self.client.post('/orders/orders/batch', headers=header, json={'orders': [{'flavour': "CHEESE"}] * 10})
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record_statement)
+        assert response.status_code == 201
+        assert len(response.json['orders']) == 10
+        # user lookup, the INSERT ... RETURNING and the status events; the orders
+        # are serialized from the returned rows rather than reloaded one by one
+        assert len(statements) == 3
+
+    def test_bulk_update_order_status(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        token = create_access_token(identity="staff")
+        header = {
+            "Authorization": f"Bearer {token}"
+        }
+        for flavour in ["BACON", "CHEESE", "BACON"]:
+            self.client.post('/orders/orders', headers=header, json={'flavour': flavour})
+        self.client.patch('/orders/orders/status', headers=header, json={'ids': [3], 'order_status': "DELIVERED"})
+
+        # true would otherwise match order 1
+        response = self.client.patch('/orders/orders/status', headers=header, json={'ids': [True], 'order_status': "IN_TRANSIT"})
+        assert response.status_code == 400
+        response = self.client.patch('/orders/orders/status', headers=header, json={'filter': {'customer': True}, 'order_status': "IN_TRANSIT"})
+        assert response.status_code == 400
+
+        data = {
+            'ids': [1, 2, 3, 42],
+            'order_status': "IN_TRANSIT"
+        }
+        response = self.client.patch('/orders/orders/status', headers=header, json=data)
+        assert response.status_code == 200
+        assert [item['result'] for item in response.json['results']] == ['updated', 'updated', 'invalid_transition', 'not_found']
+
+        data = {
+            'filter': {'flavour': "BACON"},
+            'order_status': "DELIVERED"
+        }
+        response = self.client.patch('/orders/orders/status', headers=header, json=data)
+        assert response.json['results'] == [{'id': 1, 'result': 'updated'}]
+        assert Order.query.get(2).order_status.name == "IN_TRANSIT"
+
+
+    def test_get_order_conditional(self):
+        data_user = {
+            "username": "testuser",
+            "email": "testuser@gmail.com",
+            "password": "password"
+            }
+        self.client.post('/auth/signup', json=data_user)
+        token = create_access_token(identity="testuser")
+        header = {
+            "Authorization": f"Bearer {token}"
+        }
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+
+        response = self.client.get('/orders/order/1', headers=header)
+        etag = response.headers['ETag']
+        response = self.client.get('/orders/order/1', headers=dict(header, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+
+        update = {'sizes': "LARGE", 'flavour': "BACON", 'quantity': 2}
+        self.client.patch('/orders/order/1', headers=header, json=update)
+        response = self.client.get('/orders/order/1', headers=dict(header, **{'If-None-Match': etag}))
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_stream_order_status_changes(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+
+        response = self.client.get('/orders/orders/events', headers=header)
+        assert response.mimetype == 'text/event-stream'
+        stream = iter(response.response)
+        assert next(stream) == b': connected\n\n'
+        assert not db.session().in_transaction()
+
+        self.client.patch('/orders/order/1/status', headers=header, json={'order_status': "IN_TRANSIT"})
+        event = next(stream).decode()
+        assert 'event: status_changed' in event
+        assert '"order_status": "IN_TRANSIT"' in event
+        response.close()
+
+    def test_serializer_matches_marshal(self):
+        user = User(username="testuser", email="testuser@gmail.com", password="password")
+        db.session.add(user)
+        db.session.add_all([Order(flavour=OrderFlavour.BACON, user=user), Order(flavour=OrderFlavour.CHEESE)])
+        db.session.commit()
+
+        for order in Order.query.all():
+            assert Serializer(order_model).serialize(order) == marshal(order, order_model)
+        assert Serializer(user_model).serialize(user) == marshal(user, user_model)
+        assert Serializer(order_model).serialize(None) == marshal(None, order_model)
+
+    def test_export_orders(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+        for flavour in ["BACON", "CHEESE", "PINEAPPLE"]:
+            self.client.post('/orders/orders', headers=header, json={'flavour': flavour})
+        self.client.patch('/orders/order/2/status', headers=header, json={'order_status': "DELIVERED"})
+
+        response = self.client.get('/orders/orders/export?order_status=PENDING', headers=header)
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [line['id'] for line in lines] == [1, 3]
+
+        response = self.client.get('/orders/orders/export?format=csv', headers=header)
+        rows = list(csv.reader(response.get_data(as_text=True).splitlines()))
+        assert rows[0] == list(order_model.keys())
+        assert [row[0] for row in rows[1:]] == ['1', '2', '3']
+
+    def test_order_summary_rollup(self):
+        self.app.config['ORDER_ROLLUP'] = True
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        self.client.post('/orders/orders/batch', headers=header, json={'orders': [{'flavour': "CHEESE"}, {'flavour': "BACON", 'sizes': "LARGE"}, {'flavour': "PINEAPPLE"}]})
+        self.client.patch('/orders/order/1/status', headers=header, json={'order_status': "IN_TRANSIT"})
+        self.client.patch('/orders/orders/status', headers=header, json={'ids': [1, 2], 'order_status': "DELIVERED"})
+        self.client.patch('/orders/order/3', headers=header, json={'flavour': "PEPPERONI", 'sizes': "MEDIUM", 'quantity': 4})
+        self.client.delete('/orders/order/4', headers=header)
+
+        response = self.client.get('/orders/orders/summary', headers=header)
+        assert response.status_code == 200
+        assert response.json['orders'] == 3
+        assert response.json['quantity'] == 6
+        assert response.json['revenue'] == '64.00'
+        assert response.json['order_status'] == [
+            {'key': 'PENDING', 'orders': 1, 'quantity': 4, 'revenue': '46.00'},
+            {'key': 'DELIVERED', 'orders': 2, 'quantity': 2, 'revenue': '18.00'}
+        ]
+        self.app.config['ORDER_ROLLUP'] = False
+        assert marshal(compute_summary(), summary_model) == response.json
+        self.app.config['ORDER_ROLLUP'] = True
+        OrderRollup.rebuild()
+        assert marshal(compute_summary(), summary_model) == response.json
+
+    def test_rollup_quantity_only_update(self):
+        self.app.config['ORDER_ROLLUP'] = True
+        user = User(username="testuser", email="testuser@gmail.com", password="password")
+        db.session.add(user)
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}"
+        }
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        rollup_rows = []
+
+        def count_rollup_rows(connection, cursor, statement, parameters, context, executemany):
+            if statement.startswith('INSERT INTO order_rollup'):
+                rollup_rows.append(len(parameters) // 8)
+
+        db.event.listen(db.engine, 'before_cursor_execute', count_rollup_rows)
+        try:
+            response = self.client.patch('/orders/order/1', headers=header, json={'flavour': "BACON", 'sizes': "SMALL", 'quantity': 3})
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count_rollup_rows)
+        assert response.status_code == 200
+        # PostgreSQL rejects an upsert that touches the same bucket twice
+        assert rollup_rows == [1]
+        assert [(bucket.orders, bucket.quantity) for bucket in OrderRollup.query.all()] == [(1, 3)]
+
+    def test_idempotent_order_placement(self):
+        self.client.post('/auth/signup', json={"username": "testuser", "email": "testuser@gmail.com", "password": "password"})
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}",
+            "Idempotency-Key": "place-1"
+        }
+
+        first = self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        retry = self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        assert first.status_code == retry.status_code == 201
+        assert retry.get_data() == first.get_data()
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert Order.query.count() == 1
+
+        response = self.client.post('/orders/orders', headers=header, json={'flavour': "CHEESE"})
+        assert response.status_code == 422
+
+        self.app.config['IDEMPOTENCY_WAIT'] = 0
+        body = '{"flavour": "BACON"}'
+        key = idempotency_key('testuser', 'POST', '/orders/orders', 'place-2')
+        get_idempotency_store().claim(key, hashlib.sha256(body.encode()).hexdigest(), 60)
+        response = self.client.post('/orders/orders', headers=dict(header, **{"Idempotency-Key": "place-2"}), data=body, content_type='application/json')
+        assert response.status_code == 409
+        assert Order.query.count() == 1
+
+        # the claim of a request that died mid-way lapses with its lease
+        db.session.execute(db.update(IdempotencyKey).where(IdempotencyKey.key == key).values(expires_at=datetime.utcnow()))
+        db.session.commit()
+        response = self.client.post('/orders/orders', headers=dict(header, **{"Idempotency-Key": "place-2"}), data=body, content_type='application/json')
+        assert response.status_code == 201
+        assert db.session.execute(db.select(IdempotencyKey.expires_at).where(IdempotencyKey.key == key)).scalar() > datetime.utcnow() + timedelta(hours=23)
+
+    def test_order_prices_follow_price_file(self):
+        self.client.post('/auth/signup', json={"username": "testuser", "email": "testuser@gmail.com", "password": "password"})
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}"
+        }
+        response = self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        assert response.json['unit_price'] == '10.00'
+        assert response.json['total'] == '10.00'
+
+        prices = {size: {flavour: 20 for flavour in OrderFlavour.__members__} for size in Sizes.__members__}
+        prices['LARGE']['BACON'] = 21.5
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump(prices, file)
+        self.app.extensions['price_book'] = PriceBook(file.name, check_interval=0)
+
+        response = self.client.patch('/orders/order/1', headers=header, json={'sizes': "LARGE", 'flavour': "BACON", 'quantity': 2})
+        assert response.json['unit_price'] == '21.50'
+        assert response.json['total'] == '43.00'
+
+        response = self.client.patch('/orders/order/1', headers=header, json={'sizes': "LARGE", 'flavour': "BACON", 'quantity': 3})
+        assert response.json['total'] == '64.50'
+        assert db.session.execute(db.select(db.func.sum(Order.total))).scalar() == Decimal('64.50')
+
+        # a quantity-only change keeps the price the order was placed at
+        prices['LARGE']['BACON'] = 99
+        with open(file.name, 'w') as price_file:
+            json.dump(prices, price_file)
+        os.utime(file.name, (0, 0))
+        response = self.client.patch('/orders/order/1', headers=header, json={'sizes': "LARGE", 'flavour': "BACON", 'quantity': 4})
+        assert response.json['unit_price'] == '21.50'
+        assert response.json['total'] == '86.00'
+
+        # a price file that disappears leaves the last loaded prices in place
+        os.rename(file.name, file.name + '.moved')
+        self.addCleanup(os.remove, file.name + '.moved')
+        with self.assertLogs('api.utils.pricing', level='WARNING'):
+            response = self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        assert response.status_code == 201
+        assert response.json['unit_price'] == '20.00'
+
+    def test_kitchen_next_batch(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+        assert self.client.post('/orders/kitchen/next-batch', headers=header).status_code == 204
+
+        self.client.post('/orders/orders', headers=header, json={'flavour': "CHEESE"})
+        self.client.post('/orders/orders/batch', headers=header, json={'orders': [
+            {'flavour': "BACON", 'quantity': 3}, {'flavour': "BACON", 'quantity': 4}, {'flavour': "BACON", 'quantity': 2}
+        ]})
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        self.client.delete('/orders/order/5', headers=header)
+
+        response = self.client.get('/orders/kitchen/next-batch', headers=header)
+        assert response.json['flavour'] == 'BACON'
+        assert [order['id'] for order in response.json['orders']] == [2, 3]
+        assert response.json['quantity'] == 7
+
+        response = self.client.post('/orders/kitchen/next-batch', headers=header)
+        assert [order['id'] for order in response.json['orders']] == [2, 3]
+        assert [order['order_status'] for order in response.json['orders']] == ['OrderStatus.IN_TRANSIT'] * 2
+
+        response = self.client.post('/orders/kitchen/next-batch', headers=header)
+        assert [order['id'] for order in response.json['orders']] == [4]
+        response = self.client.post('/orders/kitchen/next-batch', headers=header)
+        assert [order['id'] for order in response.json['orders']] == [1]
+        assert self.client.post('/orders/kitchen/next-batch', headers=header).status_code == 204
+
+        # changes made by another worker arrive with the next incremental sync
+        self.client.post('/orders/orders', headers=header, json={'flavour': "SAUSAGE"})
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(Order).values(flavour=OrderFlavour.PINEAPPLE, date_created=datetime.utcnow() - timedelta(hours=1)))
+            connection.execute(db.update(Order).where(Order.flavour == OrderFlavour.SAUSAGE).values(order_status=OrderStatus.DELIVERED, updated_at=datetime.utcnow()))
+        self.app.extensions['kitchen_queue'].loaded_at -= self.app.config['KITCHEN_RESYNC_INTERVAL']
+        response = self.client.post('/orders/kitchen/next-batch', headers=header)
+        assert [order['flavour'] for order in response.json['orders']] == ['OrderFlavour.PINEAPPLE']
+        assert self.client.post('/orders/kitchen/next-batch', headers=header).status_code == 204
+
+    def test_order_events_outbox(self):
+        dispatcher = get_event_dispatcher()
+        dispatcher.outbox = True
+        dispatcher.workers = 1
+        events = []
+        for name in ('order_created', 'status_changed', 'order_deleted'):
+            dispatcher.subscribe(name, events.append)
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        self.client.post('/orders/orders/batch', headers=header, json={'orders': [{'flavour': "CHEESE"}]})
+        self.client.patch('/orders/order/1/status', headers=header, json={'order_status': "IN_TRANSIT"})
+        self.client.patch('/orders/orders/status', headers=header, json={'ids': [2], 'order_status': "DELIVERED"})
+        self.client.post('/orders/orders', headers=header, json={'flavour': "PINEAPPLE"})
+        self.client.delete('/orders/order/3', headers=header)
+        dispatcher.join()
+
+        assert [(event.name, event.payload['id']) for event in events] == [
+            ('order_created', 1), ('order_created', 2), ('status_changed', 1), ('status_changed', 2),
+            ('order_created', 3), ('order_deleted', 3)
+        ]
+        assert events[2].payload == {'id': 1, 'customer': 1, 'order_status': 'IN_TRANSIT', 'version': 2}
+        assert OutboxEvent.query.filter(OutboxEvent.dispatched_at.is_(None)).count() == 0
+
+        # a failing event is skipped rather than ending or stalling the relay
+        def fail(event):
+            raise RuntimeError(event.id)
+
+        dispatcher.subscribe('order_failing', fail)
+        db.session.add(OutboxEvent(id='failing', name='order_failing', payload='{}', created_at=datetime.utcnow() - timedelta(hours=2)))
+        db.session.add(OutboxEvent(id='lost', name='order_deleted', payload='{"id": 2}', created_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        with self.assertLogs('api.utils.dispatch', level='ERROR'):
+            result = self.app.test_cli_runner().invoke(args=["events", "relay", "--batch-size", "1"])
+        assert "Delivered 1 outbox events, 1 failed" in result.output
+        assert events[-1].payload == {'id': 2}
+        assert db.session.get(OutboxEvent, 'lost').dispatched_at is not None
+        assert db.session.get(OutboxEvent, 'failing').dispatched_at is None
+
+    def test_event_dispatcher_ordering_and_backpressure(self):
+        dispatcher = EventDispatcher(self.app, workers=4)
+        seen = []
+        dispatcher.subscribe('status_changed', lambda event: (time.sleep(random.random() / 1000), seen.append(event.payload)))
+        for version in range(1, 21):
+            for id in (1, 2, 3):
+                dispatcher.submit(DomainEvent(f'{id}.{version}', 'status_changed', {'id': id, 'version': version}))
+        dispatcher.join()
+        for id in (1, 2, 3):
+            assert [payload['version'] for payload in seen if payload['id'] == id] == list(range(1, 21))
+
+        # without an outbox a full queue hands the event to the committing thread
+        dispatcher = EventDispatcher(self.app, workers=1, maxsize=1, submit_timeout=0.01)
+        handled, started, release = [], threading.Event(), threading.Event()
+
+        def handler(event):
+            if event.id == 'first':
+                started.set()
+                release.wait(5)
+            handled.append(event.id)
+
+        dispatcher.subscribe('status_changed', handler)
+        dispatcher.submit(DomainEvent('first', 'status_changed', {'id': 1}))
+        started.wait(5)
+        dispatcher.submit(DomainEvent('queued', 'status_changed', {'id': 1}))
+        with self.assertLogs('api.utils.dispatch', level='WARNING'):
+            dispatcher.submit(DomainEvent('inline', 'status_changed', {'id': 1}))
+        assert handled == ['inline']
+        release.set()
+        dispatcher.join()
+        assert sorted(handled) == ['first', 'inline', 'queued']
+
+    def test_order_status_timeline_and_times(self):
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+
+        self.client.post('/orders/orders/batch', headers=header, json={'orders': [{'flavour': "CHEESE"}] * 4})
+        self.client.patch('/orders/order/1/status', headers=header, json={'order_status': "IN_TRANSIT"})
+        self.client.patch('/orders/order/2/status', headers=header, json={'order_status': "PENDING"})
+        self.client.patch('/orders/orders/status', headers=header, json={'ids': [1, 2, 3, 4], 'order_status': "DELIVERED"})
+
+        response = self.client.get('/orders/order/2/timeline', headers=header)
+        assert [event['order_status'] for event in response.json['events']] == ['PENDING', 'DELIVERED']
+        response = self.client.get('/orders/order/1/timeline', headers=header)
+        assert response.status_code == 200
+        assert [event['order_status'] for event in response.json['events']] == ['PENDING', 'IN_TRANSIT', 'DELIVERED']
+
+        now = datetime.utcnow()
+        for order_id, minutes in ((1, 1), (2, 2), (3, 3), (4, 10)):
+            db.session.execute(db.update(OrderStatusEvent).where(
+                OrderStatusEvent.order_id == order_id, OrderStatusEvent.status == OrderStatus.PENDING
+            ).values(at=now - timedelta(minutes=minutes)))
+            db.session.execute(db.update(OrderStatusEvent).where(
+                OrderStatusEvent.order_id == order_id, OrderStatusEvent.status == OrderStatus.DELIVERED
+            ).values(at=now))
+        # a re-entered PENDING status does not count the order twice
+        OrderStatusEvent.record(db.session, [(4, OrderStatus.PENDING, now - timedelta(minutes=1))])
+        db.session.commit()
+
+        response = self.client.get('/orders/orders/status-times', headers=header,
+                                   query_string={'until': (now + timedelta(seconds=1)).isoformat()})
+        assert response.status_code == 200
+        assert response.json['orders'] == 4
+        assert round(response.json['p50']) == 120
+        assert round(response.json['p95']) == 600
+
+        response = self.client.get('/orders/orders/status-times', headers=header,
+                                   query_string={'since': now.isoformat(), 'until': now.isoformat()})
+        assert response.status_code == 400
+
+    def test_request_metrics(self):
+        metrics = self.app.extensions['request_metrics']
+        metrics.slow_request = 1e-9
+        db.session.add(User(username="staff", email="staff@gmail.com", password="password", is_staff=True))
+        db.session.commit()
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='staff')}"
+        }
+
+        with self.assertLogs('api.utils.metrics', level='WARNING') as logs:
+            self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+            self.client.get('/orders/orders', headers=header)
+        assert 'Slow request POST /orders/orders 201 (Orders)' in logs.output[0]
+        assert 'INSERT INTO orders' in logs.output[0]
+
+        assert self.client.get('/metrics').status_code == 404
+        self.app.config['METRICS_TOKEN'] = 'scraper'
+        assert self.client.get('/metrics', headers=header).status_code == 401
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scraper'})
+        assert response.status_code == 200
+        lines = response.get_data(as_text=True).splitlines()
+        assert 'http_request_duration_seconds_count{endpoint="Orders",method="GET",status="200"} 1' in lines
+        assert 'http_request_duration_seconds_bucket{endpoint="Orders",method="POST",status="201",le="+Inf"} 1' in lines
+        queries = next(line for line in lines if line.startswith('http_request_db_queries_sum{endpoint="Orders",method="POST"'))
+        assert float(queries.split()[-1]) > 0
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+        class ReplicaConfig(config_dict['test']):
+            SQLALCHEMY_ECHO = False
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmpdir.name, 'primary.db')
+            SQLALCHEMY_BINDS = {'replica_0': 'sqlite:///' + os.path.join(self.tmpdir.name, 'replica.db')}
+            SQLALCHEMY_REPLICAS = ['replica_0']
+
+        self.app = create_app(config=ReplicaConfig)
+        self.appctx = self.app.app_context()
+        self.appctx.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        db.metadata.create_all(db.engines['replica_0'])
+
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        db.metadatas.pop('replica_0', None)
+        self.appctx.pop()
+        self.tmpdir.cleanup()
+
+    def test_reads_use_replica_until_caller_writes(self):
+        with db.engines['replica_0'].begin() as connection:
+            connection.execute(db.insert(Order), {'flavour': OrderFlavour.CHEESE})
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}"
+        }
+
+        response = self.client.get('/orders/orders', headers=header)
+        assert [order['flavour'] for order in response.json] == ['OrderFlavour.CHEESE']
+
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        # the test app context outlives requests, so end the session like a request would
+        db.session.remove()
+        # another worker sharing the store also pins the caller to the primary
+        assert 'testuser' in RecentWriters(self.app.extensions['replica_recent_writers'].client)
+        response = self.client.get('/orders/orders', headers=header)
+        assert [order['flavour'] for order in response.json] == ['OrderFlavour.BACON']
+
+        other_header = {
+            "Authorization": f"Bearer {create_access_token(identity='otheruser')}"
+        }
+        response = self.client.get('/orders/orders', headers=other_header)
+        assert [order['flavour'] for order in response.json] == ['OrderFlavour.CHEESE']
@@ -70,7 +70,31 @@ class UserTestCase(unittest.TestCase):
 
         assert len(orders) == 2
         assert response.status_code == 200
-        
+        assert [order['id'] for order in response.json] == [1, 2]
+
+        response = self.client.get('/user/1/orders?limit=1', headers=header)
+        assert [order['id'] for order in response.json] == [1]
+        assert 'X-Next-Cursor' in response.headers
+
+    def test_get_all_user_orders_conditional(self):
+        self.client.post('/auth/signup', json={"username": "testuser", "email": "testuser@gmail.com", "password": "password"})
+        header = {
+            "Authorization": f"Bearer {create_access_token(identity='testuser')}"
+        }
+        assert self.client.get('/user/2/orders', headers=header).status_code == 404
+        self.client.post('/orders/orders', headers=header, json={'flavour': "BACON"})
+        self.client.post('/orders/orders', headers=header, json={'flavour': "CHEESE"})
+
+        response = self.client.get('/user/1/orders', headers=header)
+        etag = response.headers['ETag']
+        assert 'Last-Modified' not in response.headers
+        assert self.client.get('/user/1/orders', headers=dict(header, **{'If-None-Match': etag})).status_code == 304
+
+        self.client.delete('/orders/order/2', headers=header)
+        response = self.client.get('/user/1/orders', headers=dict(header, **{'If-None-Match': etag}))
+        assert response.status_code == 200
+        assert [order['id'] for order in response.json] == [1]
+
     def test_give_admin_privileges(self):
         token = create_access_token(identity="testuser")
         
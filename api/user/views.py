@@ -1,10 +1,16 @@
-from flask_restx import Namespace, Resource, fields
-from flask import abort
+from flask_restx import Namespace, Resource, fields, reqparse
+from flask import abort, request
+import hashlib
 from ..models.users import User
 from ..models.orders import Order
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import jwt_required, get_jwt
 from http import HTTPStatus
 from ..utils import db
+from ..utils.identity import current_user_is_staff, forget_user
+from ..utils.replicas import use_replica
+from ..utils.conditional import conditional
+from ..utils.serializer import serialize_with
+from ..utils.pagination import keyset_paginate, page_limit
 
 user_namespace = Namespace('user', 'Namespace for user order')
 
@@ -32,62 +38,82 @@ user_model = user_namespace.model(
     }
 )
 
+user_orders_parser = reqparse.RequestParser()
+user_orders_parser.add_argument('limit', type=int, location='args', help='Maximum number of orders to return')
+user_orders_parser.add_argument('cursor', type=str, location='args', help='Value of the X-Next-Cursor header of the previous page')
+
+
+def user_orders_validators(resource, user_id):
+    # no Last-Modified: deleting an order does not move the latest update time
+    if db.session.query(User.id).filter_by(id=user_id).first() is None:
+        return None
+    count, last_id, versions = Order.customer_validators(user_id)
+    state = f'{user_id}.{count}.{last_id}.{versions}.{request.query_string.decode()}'
+    return hashlib.sha1(state.encode()).hexdigest(), None
+
+
 @user_namespace.route('/<int:user_id>/orders/<int:order_id>')
 class GetSpecificOrderByUser(Resource):
     @jwt_required()
-    @user_namespace.marshal_list_with(order_model)
+    @serialize_with(order_model)
     @user_namespace.doc(description="Get a user specific order with the user id and order id",
                             params= {
                                 'order_id': "The order id",
                                 "user_id": "The user id"
                             }
     )
+    @use_replica
     def get(self, user_id, order_id):
         """
         Gets a user specific order
         """
         user = User.get_by_id(user_id)
 
-        order = Order.query.filter_by(id=order_id).filter_by(user=user).first()
+        order = db.session.execute(Order.select_rows(Order.id == order_id, Order.customer == user.id)).first()
 
         return order, HTTPStatus.OK #NOTE
 
 
 @user_namespace.route('/<int:user_id>/orders')
 class GetOrdersByUser(Resource):
-    @user_namespace.marshal_list_with(order_model)
-    @user_namespace.doc(description="Get all orders of a particular user with the user id",
+    @jwt_required()
+    @use_replica
+    @conditional(user_orders_validators)
+    @user_namespace.expect(user_orders_parser)
+    @serialize_with(order_model, as_list=True)
+    @user_namespace.doc(description="Get a page of orders of a particular user with the user id. The cursor for the next page is returned in the X-Next-Cursor header. Supports If-None-Match",
                             params= {
                                 'user_id': "The user id"
                             } 
     )
-    @jwt_required()
     def get(self, user_id):
         """
         Get all orders by a particular user
         """
-        user = User.get_by_id(user_id)
-        orders = user.orders
+        User.get_by_id(user_id)
+        args = user_orders_parser.parse_args()
+        statement = Order.select_rows(Order.customer == user_id)
+        orders, next_cursor = keyset_paginate(statement, Order.date_created, Order.id, args.get('cursor'), page_limit(args.get('limit')))
 
-        return orders, 200
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return orders, 200, headers
 
 @user_namespace.route('/user/<int:user_id>')
 class UserViews(Resource):
     @jwt_required()
-    @user_namespace.marshal_with(user_model)
+    @serialize_with(user_model)
     @user_namespace.doc(description="Get a user with the user id. Only admins can access this route",
                             params= {
                                 'user_id': "The user id"
                             } 
     )
+    @use_replica
     def get(self, user_id):
         """
         Get a user's details
         """
-        user_name = get_jwt_identity()
-        staff = User.query.filter_by(username=user_name).first()
-        if staff.is_staff:
-            user = User.get_by_id(user_id)
+        if current_user_is_staff():
+            user = User.get_with_orders(user_id)
             return user, HTTPStatus.OK
         
 
@@ -101,12 +127,11 @@ class UserViews(Resource):
         """
         Delete a user
         """
-        user_name = get_jwt_identity()
-        staff = User.query.filter_by(username=user_name).first()
         user =  User.get_by_id(user_id)
-        if staff.is_staff:
+        if current_user_is_staff():
             db.session.delete(user)
             db.session.commit()
+            forget_user(user.username)
             return {"message": "User deleted successfully"}, HTTPStatus.OK
 
     @jwt_required()
@@ -125,6 +150,7 @@ class UserViews(Resource):
             abort(401, "Admin privilege only")
         user = User.query.get_or_404(user_id)
         user.make_admin()
+        forget_user(user.username)
         return user, HTTPStatus.OK
 
         
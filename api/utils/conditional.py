@@ -0,0 +1,43 @@
+from functools import wraps
+from http import HTTPStatus
+from flask import current_app, request
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional(validators):
+    """
+    Answer If-None-Match / If-Modified-Since with 304 before calling the
+    view. validators(*args, **kwargs) returns (etag, last_modified) for the
+    resource, or None to let the view run and report the error.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            current = validators(*args, **kwargs)
+            if current is None:
+                return func(*args, **kwargs)
+            etag, last_modified = current
+            headers = {'ETag': f'"{etag}"'}
+            if last_modified:
+                headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+            if not_modified(etag, last_modified):
+                return current_app.response_class(status=HTTPStatus.NOT_MODIFIED, headers=headers)
+
+            response = func(*args, **kwargs)
+            if isinstance(response, current_app.response_class):
+                response.headers.extend(headers)
+                return response
+            if not isinstance(response, tuple):
+                return response, HTTPStatus.OK, headers
+            data, code, *rest = response
+            return data, code, dict(rest[0] if rest else {}, **headers)
+        return wrapper
+    return decorator
@@ -0,0 +1,169 @@
+import json
+import logging
+import queue
+import threading
+import uuid
+from collections import namedtuple, defaultdict
+from datetime import datetime
+from flask import current_app, has_app_context
+from . import db
+from .replicas import RoutingSession
+from ..models.outbox import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DomainEvent = namedtuple('DomainEvent', 'id name payload')
+
+
+class EventDispatcher:
+    """
+    Runs the subscribers of domain events after the transaction that raised
+    them commits, on a pool of background threads each fed by its own
+    bounded queue. Events of one order always go to the same thread, so
+    subscribers see them in commit order. With workers=0 subscribers run
+    inline. With the outbox enabled events are also written to
+    outbox_events in their transaction and marked dispatched once handled,
+    so 'flask events relay' can deliver the ones lost to a crash or a full
+    queue. Without it a full queue blocks the committing request for up to
+    submit_timeout seconds, then the event is handled inline.
+    """
+    def __init__(self, app, workers=2, maxsize=1000, outbox=False, submit_timeout=5):
+        self.app = app
+        self.workers = workers
+        self.maxsize = maxsize
+        self.outbox = outbox
+        self.submit_timeout = submit_timeout
+        self.queues = []
+        self.subscribers = defaultdict(list)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, handler):
+        self.subscribers[name].append(handler)
+
+    def _queue_for(self, event):
+        key = event.payload.get('id') if isinstance(event.payload, dict) else None
+        return self.queues[hash(event.id if key is None else key) % len(self.queues)]
+
+    def submit(self, event):
+        if self.workers <= 0 or threading.current_thread() in self._threads:
+            self.handle(event)
+            return True
+        self._start()
+        queue_ = self._queue_for(event)
+        if self.outbox:
+            try:
+                queue_.put_nowait(event)
+                return True
+            except queue.Full:
+                logger.warning('Event queue full, %s %s left to the outbox relay', event.name, event.id)
+                return False
+        try:
+            queue_.put(event, timeout=self.submit_timeout)
+            return True
+        except queue.Full:
+            logger.warning('Event queue full for %ss, handling %s %s inline', self.submit_timeout, event.name, event.id)
+            self.handle(event)
+            return True
+
+    def handle(self, event):
+        """
+        Call every subscriber of the event and mark it dispatched, or leave
+        it in the outbox if a subscriber fails
+        """
+        failed = False
+        for handler in self.subscribers.get(event.name, ()):
+            try:
+                handler(event)
+            except Exception:
+                failed = True
+                logger.exception('Subscriber %r failed on %s %s', handler, event.name, event.id)
+        if self.outbox and not failed:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    db.update(OutboxEvent).where(OutboxEvent.id == event.id).values(dispatched_at=datetime.utcnow())
+                )
+        return not failed
+
+    def join(self):
+        for queue_ in self.queues:
+            queue_.join()
+
+    def _start(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                queue_ = queue.Queue(maxsize=self.maxsize)
+                thread = threading.Thread(target=self._work, args=(queue_,), name=f'event-worker-{len(self._threads)}', daemon=True)
+                self.queues.append(queue_)
+                self._threads.append(thread)
+                thread.start()
+
+    def _work(self, queue_):
+        while True:
+            event = queue_.get()
+            try:
+                with self.app.app_context():
+                    self.handle(event)
+            except Exception:
+                logger.exception('Could not dispatch %s %s', event.name, event.id)
+            finally:
+                queue_.task_done()
+
+
+def create_event_dispatcher(app):
+    return EventDispatcher(
+        app,
+        workers=app.config['EVENTS_WORKERS'],
+        maxsize=app.config['EVENTS_QUEUE_SIZE'],
+        outbox=app.config['EVENTS_OUTBOX'],
+        submit_timeout=app.config['EVENTS_SUBMIT_TIMEOUT']
+    )
+
+
+def get_event_dispatcher():
+    return current_app.extensions['event_dispatcher']
+
+
+def record_event(session, connection, name, payload):
+    """
+    Raise a domain event in the current transaction of session. connection
+    is the one the transaction writes through, used for the outbox row.
+    """
+    if not has_app_context():
+        return
+    event = DomainEvent(str(uuid.uuid4()), name, payload)
+    if get_event_dispatcher().outbox:
+        connection.execute(db.insert(OutboxEvent).values(
+            id=event.id, name=name, payload=json.dumps(payload), created_at=datetime.utcnow()
+        ))
+    session.info.setdefault('domain_events', []).append(event)
+
+
+def relay_undelivered(older_than, limit=1000, after=None):
+    """
+    Handle one batch of outbox events that were never marked dispatched and
+    return (fetched, delivered, last), last being the (created_at, id) to
+    pass as after for the next batch so that failed events are skipped
+    """
+    dispatcher = get_event_dispatcher()
+    rows = OutboxEvent.undelivered(older_than, limit, after)
+    delivered = 0
+    for row in rows:
+        delivered += dispatcher.handle(DomainEvent(row.id, row.name, json.loads(row.payload)))
+    last = (rows[-1].created_at, rows[-1].id) if rows else after
+    db.session.expire_all()
+    return len(rows), delivered, last
+
+
+@db.event.listens_for(RoutingSession, 'after_commit')
+def dispatch_events(session):
+    events = session.info.pop('domain_events', None)
+    for event in events or ():
+        get_event_dispatcher().submit(event)
+
+
+@db.event.listens_for(RoutingSession, 'after_rollback')
+def discard_events(session):
+    session.info.pop('domain_events', None)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, request, abort
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from flask_restx.utils import merge, unpack
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .cache import TTLCache, MISSING
+from ..models.idempotency import IdempotencyKey
+
+StoredResponse = namedtuple('StoredResponse', 'fingerprint status_code headers body')
+
+REPLAYED_HEADERS = ('Content-Type', 'Location', 'ETag', 'Last-Modified')
+
+
+class DatabaseIdempotencyStore:
+    """
+    Keys are rows of the idempotency_keys table; the unique key column makes
+    claiming a key atomic across workers
+    """
+    def get(self, key):
+        row = db.session.execute(
+            db.select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.headers, IdempotencyKey.body)
+            .where(IdempotencyKey.key == key, IdempotencyKey.expires_at > datetime.utcnow())
+        ).first()
+        if row is None:
+            return None
+        fingerprint, status_code, headers, body = row
+        return StoredResponse(fingerprint, status_code, headers and json.loads(headers), body)
+
+    def claim(self, key, fingerprint, lease):
+        """
+        Record that a request with key is running for up to lease seconds
+        and return None, or return what is stored for the key if another
+        request claimed it first
+        """
+        while True:
+            # get() compares with the current time, so the delete must too
+            now = datetime.utcnow()
+            db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.expires_at <= now))
+            try:
+                db.session.execute(db.insert(IdempotencyKey).values(
+                    key=key, fingerprint=fingerprint, created_at=now, expires_at=now + timedelta(seconds=lease)
+                ))
+                db.session.commit()
+                return None
+            except IntegrityError:
+                db.session.rollback()
+            stored = self.get(key)
+            if stored is not None:
+                return stored
+
+    def complete(self, key, status_code, headers, body, ttl):
+        db.session.execute(
+            db.update(IdempotencyKey).where(IdempotencyKey.key == key).values(
+                status_code=status_code, headers=json.dumps(headers), body=body,
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+            )
+        )
+        db.session.commit()
+
+    def release(self, key):
+        db.session.rollback()
+        db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.key == key))
+        db.session.commit()
+
+
+class MemoryIdempotencyStore:
+    """
+    Keys in a bounded TTL cache of this process, for tests and single
+    worker deployments
+    """
+    def __init__(self, maxsize=100000, ttl=86400):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        stored = self._cache.get(key)
+        return None if stored is MISSING else stored
+
+    def claim(self, key, fingerprint, lease):
+        with self._lock:
+            stored = self._cache.get(key)
+            if stored is MISSING:
+                self._cache.set(key, StoredResponse(fingerprint, None, None, None), lease)
+                return None
+            return stored
+
+    def complete(self, key, status_code, headers, body, ttl):
+        with self._lock:
+            stored = self._cache.get(key)
+            if stored is not MISSING:
+                self._cache.set(key, stored._replace(status_code=status_code, headers=headers, body=body), ttl)
+
+    def release(self, key):
+        self._cache.pop(key)
+
+
+def create_idempotency_store(app):
+    backend = app.config['IDEMPOTENCY_BACKEND']
+    if backend == 'memory':
+        return MemoryIdempotencyStore(maxsize=app.config['IDEMPOTENCY_CACHE_SIZE'], ttl=app.config['IDEMPOTENCY_TTL'])
+    if backend != 'database':
+        raise ValueError(f'Unknown idempotency backend {backend!r}')
+    return DatabaseIdempotencyStore()
+
+
+def get_idempotency_store():
+    return current_app.extensions['idempotency_store']
+
+
+def idempotency_key(identity, method, path, header):
+    """
+    Storage key of an Idempotency-Key header, scoped to the caller and route
+    """
+    return hashlib.sha256('\0'.join([str(identity), method, path, header]).encode()).hexdigest()
+
+
+def replay(stored):
+    response = current_app.response_class(stored.body, status=stored.status_code, headers=stored.headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(func):
+    """
+    Run a resource method once per Idempotency-Key header and the current
+    identity. Retries get the stored first response byte for byte; a retry
+    arriving while the first request runs waits for it for up to
+    IDEMPOTENCY_WAIT seconds. The first request holds the key for
+    IDEMPOTENCY_LEASE seconds, so a worker that dies mid-request does not
+    block retries until IDEMPOTENCY_TTL. 5xx responses and exceptions are
+    not stored.
+    """
+    @wraps(func)
+    def wrapper(resource, *args, **kwargs):
+        header = request.headers.get('Idempotency-Key')
+        if header is None:
+            return func(resource, *args, **kwargs)
+        if not header or len(header) > 255:
+            abort(400, 'Idempotency-Key must be 1 to 255 characters')
+        verify_jwt_in_request()
+        key = idempotency_key(get_jwt_identity(), request.method, request.path, header)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        store = get_idempotency_store()
+
+        lease = current_app.config['IDEMPOTENCY_LEASE']
+        stored = store.claim(key, fingerprint, lease)
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT']
+        while stored is not None:
+            if stored.fingerprint != fingerprint:
+                abort(422, 'Idempotency-Key was already used with a different request')
+            if stored.status_code is not None:
+                return replay(stored)
+            if time.monotonic() >= deadline:
+                abort(409, 'A request with this Idempotency-Key is still in progress')
+            time.sleep(0.05)
+            stored = store.get(key)
+            if stored is None:
+                stored = store.claim(key, fingerprint, lease)
+
+        try:
+            response = func(resource, *args, **kwargs)
+            if not isinstance(response, current_app.response_class):
+                data, code, headers = unpack(response)
+                response = resource.api.make_response(data, code, headers=headers)
+        except BaseException:
+            store.release(key)
+            raise
+        if response.status_code >= 500:
+            store.release(key)
+        else:
+            headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            store.complete(key, response.status_code, headers, response.get_data(), current_app.config['IDEMPOTENCY_TTL'])
+        return response
+
+    doc = {'params': {'Idempotency-Key': {'in': 'header', 'type': 'string', 'description': 'Replay the first response for retries with the same key'}}}
+    wrapper.__apidoc__ = merge(getattr(wrapper, '__apidoc__', {}), doc)
+    return wrapper
@@ -0,0 +1,62 @@
+from collections import namedtuple
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from .cache import TTLCache, MISSING
+from ..models.users import User
+
+UserRecord = namedtuple('UserRecord', ['id', 'username', 'is_staff', 'is_active'])
+
+
+def user_claims(user):
+    return {
+        "user_id": user.id,
+        "is_staff": bool(user.is_staff),
+        "is_active": bool(user.is_active)
+    }
+
+
+def create_user_cache(app):
+    if app.config['USER_CACHE_TTL'] <= 0:
+        return None
+    return TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+
+def get_user_record(username):
+    """
+    Load the columns needed for authorization for a username, through the
+    short-lived user cache when USER_CACHE_TTL is set
+    """
+    cache = current_app.extensions.get('user_cache')
+    record = MISSING if cache is None else cache.get(username)
+    if record is MISSING:
+        user = User.query.filter_by(username=username).first()
+        record = None if user is None else UserRecord(user.id, user.username, bool(user.is_staff), bool(user.is_active))
+        if cache is not None:
+            cache.set(username, record)
+    return record
+
+
+def forget_user(username):
+    cache = current_app.extensions.get('user_cache')
+    if cache is not None:
+        cache.pop(username)
+
+
+def current_user_id():
+    """
+    Id of the user making the request, read from the token when it
+    carries the user_id claim
+    """
+    claims = get_jwt()
+    if "user_id" in claims:
+        return claims["user_id"]
+    record = get_user_record(get_jwt_identity())
+    return record.id if record else None
+
+
+def current_user_is_staff():
+    claims = get_jwt()
+    if "is_staff" in claims:
+        return claims["is_staff"]
+    record = get_user_record(get_jwt_identity())
+    return record.is_staff if record else False
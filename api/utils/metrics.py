@@ -0,0 +1,204 @@
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from flask import Response, abort, current_app, request
+from sqlalchemy.engine import Engine
+from . import db
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+METRICS = (
+    ('http_request_duration_seconds', 'Request latency in seconds by resource', LATENCY_BUCKETS),
+    ('http_request_db_queries', 'SQL statements executed per request', QUERY_BUCKETS),
+    ('http_request_db_seconds', 'Time spent executing SQL per request', LATENCY_BUCKETS)
+)
+
+_current = ContextVar('request_stats', default=None)
+
+
+class Histogram:
+    """
+    Prometheus style histogram; counts are per bucket and made cumulative
+    when rendered
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """
+    Timings of the request being handled, filled in by the engine listeners
+    """
+    __slots__ = ('started', 'status', 'queries', 'db_time', 'statements', 'max_statements', 'query_started')
+
+    def __init__(self, max_statements=0):
+        self.started = time.perf_counter()
+        self.status = 500
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = [] if max_statements else None
+        self.max_statements = max_statements
+        self.query_started = None
+
+
+class RequestMetrics:
+    """
+    Latency, SQL statement count and SQL time histograms per resource,
+    method and status of this process. With slow_request seconds set the
+    statements of each request are kept and logged when it is slower.
+    """
+    def __init__(self, slow_request=0, max_statements=20):
+        self.slow_request = slow_request
+        self.max_statements = max_statements
+        self._series = {}
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def endpoint_label(self, endpoint):
+        """
+        Name of the flask-restx Resource behind a Flask endpoint
+        """
+        label = self._endpoints.get(endpoint)
+        if label is None:
+            view = current_app.view_functions.get(endpoint)
+            view_class = getattr(view, 'view_class', None)
+            label = view_class.__name__ if view_class is not None else endpoint or 'unmatched'
+            self._endpoints[endpoint] = label
+        return label
+
+    def start(self):
+        _current.set(RequestStats(self.max_statements if self.slow_request else 0))
+
+    def finish(self):
+        stats = _current.get()
+        if stats is None:
+            return
+        _current.set(None)
+        elapsed = time.perf_counter() - stats.started
+        # one proxy lookup instead of one per attribute
+        current = request._get_current_object()
+        key = (self.endpoint_label(current.endpoint), current.method, stats.status)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [Histogram(buckets) for name, help, buckets in METRICS]
+            series[0].observe(elapsed)
+            series[1].observe(stats.queries)
+            series[2].observe(stats.db_time)
+        if self.slow_request and elapsed >= self.slow_request:
+            self.log_slow(key, elapsed, stats)
+
+    def log_slow(self, key, elapsed, stats):
+        lines = [
+            f'{duration * 1000:8.2f} ms  {statement}'
+            for statement, duration in stats.statements
+        ]
+        if stats.queries > len(stats.statements):
+            lines.append(f'... {stats.queries - len(stats.statements)} more statements')
+        logger.warning(
+            'Slow request %s %s %s (%s): %.1f ms, %d statements in %.1f ms\n%s',
+            key[1], request.path, key[2], key[0], elapsed * 1000, stats.queries, stats.db_time * 1000, '\n'.join(lines)
+        )
+
+    def render(self):
+        """
+        Every series in the Prometheus text exposition format
+        """
+        with self._lock:
+            snapshot = [
+                (key, [(list(histogram.counts), histogram.sum, histogram.count) for histogram in series])
+                for key, series in sorted(self._series.items(), key=lambda item: tuple(map(str, item[0])))
+            ]
+        lines = []
+        for index, (name, help, buckets) in enumerate(METRICS):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (endpoint, method, status), histograms in snapshot:
+                counts, total, count = histograms[index]
+                labels = f'endpoint="{endpoint}",method="{method}",status="{status}"'
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {total}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def create_request_metrics(app):
+    if not app.config['METRICS_ENABLED']:
+        return None
+    return RequestMetrics(
+        slow_request=app.config['METRICS_SLOW_REQUEST_MS'] / 1000,
+        max_statements=app.config['METRICS_SLOW_STATEMENTS']
+    )
+
+
+def register_request_metrics(app, metrics):
+    """
+    Time every request of app into metrics and serve them on /metrics to
+    scrapers that send the METRICS_TOKEN bearer token
+    """
+    if metrics is None:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        metrics.start()
+
+    @app.after_request
+    def record_status(response):
+        stats = _current.get()
+        if stats is not None:
+            stats.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_request_timer(error=None):
+        metrics.finish()
+
+    def metrics_view():
+        token = current_app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            abort(401)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(connection, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None:
+        stats.query_started = time.perf_counter()
+
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(connection, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None or stats.query_started is None:
+        return
+    duration = time.perf_counter() - stats.query_started
+    stats.query_started = None
+    stats.queries += 1
+    stats.db_time += duration
+    statements = stats.statements
+    if statements is not None and len(statements) < stats.max_statements:
+        statements.append((' '.join(statement.split()), duration))
@@ -0,0 +1,42 @@
+import base64
+from datetime import datetime
+from flask import abort, current_app
+from sqlalchemy import tuple_
+from . import db
+
+
+def encode_cursor(created, id):
+    raw = f'{created.isoformat()}|{id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created, id = raw.split('|')
+        return datetime.fromisoformat(created), int(id)
+    except (ValueError, UnicodeError):
+        abort(400, 'Invalid cursor')
+
+
+def page_limit(limit=None):
+    limit = limit or current_app.config['ORDERS_PAGE_SIZE']
+    return max(1, min(limit, current_app.config['ORDERS_MAX_PAGE_SIZE']))
+
+
+def keyset_paginate(statement, created_column, id_column, cursor=None, limit=50):
+    """
+    Return one page of rows of a select ordered on (created, id) and the
+    cursor for the next page, or None when this is the last page
+    """
+    if cursor:
+        statement = statement.where(tuple_(created_column, id_column) > decode_cursor(cursor))
+    statement = statement.order_by(created_column, id_column).limit(limit + 1)
+    rows = db.session.execute(statement).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, created_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+
+def password_hash_method(method, iterations):
+    """
+    Werkzeug method string with the pbkdf2 iteration count made explicit so
+    that it can be compared with the prefix of stored hashes
+    """
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{iterations}'
+    return method
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords with the configured werkzeug method, optionally
+    in a bounded thread or process pool created on first use
+    """
+    def __init__(self, method, salt_length=16, executor=None, workers=0):
+        self.method = method
+        self.salt_length = salt_length
+        self.executor = executor
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):
+        if not self.executor or self.workers <= 0:
+            return func(*args)
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = EXECUTORS[self.executor](max_workers=self.workers)
+        return self._pool.submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def create_password_hasher(app):
+    return PasswordHasher(
+        password_hash_method(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_ITERATIONS']),
+        salt_length=app.config['PASSWORD_SALT_LENGTH'],
+        executor=app.config['PASSWORD_HASH_EXECUTOR'],
+        workers=app.config['PASSWORD_HASH_WORKERS']
+    )
+
+
+def get_password_hasher():
+    return current_app.extensions['password_hasher']
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+from types import MappingProxyType
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+CENTS = Decimal('0.01')
+
+SIZE_PRICES = {'SMALL': '8.00', 'MEDIUM': '10.00', 'LARGE': '12.50', 'EXTRA_LARGE': '15.00'}
+FLAVOUR_SURCHARGES = {
+    'BBQ_CHICKEN': '2.50', 'PEPPERONI': '1.50', 'SAUSAGE': '1.50', 'CHEESE': '0.00',
+    'EXTRA_CHEESE': '1.00', 'BACON': '2.00', 'PINEAPPLE': '1.00', 'MARGHERITA': '0.00'
+}
+
+
+def _name(value):
+    return getattr(value, 'name', value)
+
+
+class PriceTable:
+    """
+    Immutable size x flavour unit price lookup
+    """
+    def __init__(self, prices):
+        self._prices = MappingProxyType({
+            (size, flavour): Decimal(str(price)).quantize(CENTS)
+            for size, flavours in prices.items()
+            for flavour, price in flavours.items()
+        })
+
+    def __len__(self):
+        return len(self._prices)
+
+    @classmethod
+    def default(cls):
+        return cls({
+            size: {flavour: Decimal(price) + Decimal(surcharge) for flavour, surcharge in FLAVOUR_SURCHARGES.items()}
+            for size, price in SIZE_PRICES.items()
+        })
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a JSON object of size name -> flavour name -> price that covers
+        every size and flavour
+        """
+        with open(path) as file:
+            table = cls(json.load(file))
+        missing = [
+            (size, flavour) for size in SIZE_PRICES for flavour in FLAVOUR_SURCHARGES
+            if (size, flavour) not in table._prices
+        ]
+        if missing:
+            raise ValueError(f'{path} has no price for {missing[:5]}')
+        return table
+
+    def unit_price(self, sizes, flavour):
+        """
+        Price of one pizza; sizes and flavour are enum members or their names
+        """
+        return self._prices[_name(sizes), _name(flavour)]
+
+    def total(self, sizes, flavour, quantity):
+        return self.unit_price(sizes, flavour) * (quantity or 0)
+
+
+class PriceBook:
+    """
+    Current PriceTable, reloaded from path when the file changes. The file
+    is checked at most every check_interval seconds and a table that fails
+    to load leaves the previous one in place.
+    """
+    def __init__(self, path=None, check_interval=30):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._table = PriceTable.default()
+        if path:
+            self.reload()
+
+    @property
+    def table(self):
+        if self.path and time.monotonic() >= self._next_check:
+            with self._lock:
+                if time.monotonic() >= self._next_check:
+                    self._next_check = time.monotonic() + self.check_interval
+                    try:
+                        mtime = os.stat(self.path).st_mtime
+                    except OSError as error:
+                        logger.warning('Keeping previous prices, could not stat %s: %s', self.path, error)
+                    else:
+                        if mtime != self._mtime:
+                            self._reload()
+        return self._table
+
+    def _reload(self):
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime
+            self._table = PriceTable.load(self.path)
+        except (OSError, ValueError, KeyError) as error:
+            if self._mtime is None:
+                raise
+            logger.error('Keeping previous prices, could not load %s: %s', self.path, error)
+        if mtime is not None:
+            self._mtime = mtime
+
+    def reload(self):
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+            self._reload()
+        return self._table
+
+
+def create_price_book(app):
+    return PriceBook(app.config['PRICES_FILE'] or None, check_interval=app.config['PRICES_CHECK_INTERVAL'])
+
+
+def get_price_table():
+    return current_app.extensions['price_book'].table
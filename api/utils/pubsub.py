@@ -0,0 +1,109 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, broker, predicate=None, maxsize=100):
+        self.broker = broker
+        self.predicate = predicate
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def get(self, timeout=None):
+        """
+        Next message, or None if nothing arrived within timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    In-process fan-out to subscriber queues. A subscriber whose bounded
+    queue is full is dropped and marked overflowed rather than letting it
+    hold back publishers or grow without limit.
+    """
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, predicate=None):
+        subscription = Subscription(self, predicate, self.maxsize)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, message):
+        self.deliver(message)
+
+    def deliver(self, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.predicate and not subscription.predicate(message):
+                continue
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Publishes through a Redis channel so subscribers on every worker and
+    node receive the message. One listener thread per worker feeds the
+    local subscribers.
+    """
+    def __init__(self, client, channel, maxsize=100):
+        super().__init__(maxsize)
+        self.client = client
+        self.channel = channel
+        self._listener = None
+
+    def publish(self, message):
+        self.client.publish(self.channel, json.dumps(message))
+
+    def subscribe(self, predicate=None):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+        return super().subscribe(predicate)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for item in pubsub.listen():
+                    if item.get('type') == 'message':
+                        self.deliver(json.loads(item['data']))
+            except Exception:
+                logger.exception('Redis subscription to %s failed, resubscribing', self.channel)
+                time.sleep(1)
+
+
+def create_broker(kind, maxsize=100, redis_url=None, channel=None):
+    if kind == 'redis':
+        import redis
+        return RedisBroker(redis.Redis.from_url(redis_url), channel, maxsize)
+    if kind != 'memory':
+        raise ValueError(f'Unknown broker {kind!r}')
+    return LocalBroker(maxsize)
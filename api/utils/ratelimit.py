@@ -0,0 +1,130 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_limit(limit):
+    """
+    (capacity, tokens per second) for a limit like '10/minute', or None
+    when the limit is empty
+    """
+    if not limit:
+        return None
+    count, period = limit.split('/')
+    return int(count), int(count) / PERIODS[period.strip()]
+
+
+class MemoryBucketStore:
+    """
+    Token buckets in this process, evicting the least recently used beyond
+    maxsize keys
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """
+        Take cost tokens from the bucket for key and return 0, or the number
+        of seconds until they are available without taking any
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            retry_after = 0 if tokens >= cost else (cost - tokens) / rate
+            if not retry_after:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return tostring(retry_after)
+"""
+
+
+class RedisBucketStore:
+    """
+    Token buckets shared by every worker and node, updated atomically by a
+    Lua script on the Redis server clock
+    """
+    def __init__(self, client, prefix='ratelimit:'):
+        self.prefix = prefix
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate, cost=1):
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate, cost]))
+
+
+def create_bucket_store(app):
+    backend = app.config['RATE_LIMIT_BACKEND']
+    if backend == 'memory':
+        return MemoryBucketStore(maxsize=app.config['RATE_LIMIT_STORE_SIZE'])
+    if backend != 'redis':
+        raise ValueError(f'Unknown rate limit backend {backend!r}')
+    import redis
+    return RedisBucketStore(redis.Redis.from_url(app.config['RATE_LIMIT_REDIS_URL']))
+
+
+def client_address():
+    """
+    Address of the client; behind proxies this relies on PROXY_FIX_X_FOR
+    being the number of trusted hops that set X-Forwarded-For
+    """
+    return request.remote_addr or ''
+
+
+def login_account():
+    data = request.get_json(silent=True) or {}
+    email = data.get('email')
+    return email.lower() if isinstance(email, str) else None
+
+
+def rate_limit(name, setting, key=client_address):
+    """
+    Decorator rejecting requests with 429 and Retry-After once the token
+    bucket for name and key(), sized by the limit in config[setting], is
+    empty. Requests for which key() returns None are not limited.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            limit = parse_limit(current_app.config[setting])
+            value = key() if limit else None
+            if value is not None:
+                capacity, rate = limit
+                retry_after = current_app.extensions['rate_limit_store'].take(f'{name}:{value}', capacity, rate)
+                if retry_after:
+                    raise TooManyRequests('Too many requests, try again later', retry_after=math.ceil(retry_after))
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+import random
+from functools import wraps
+from flask import current_app, g, has_app_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+
+
+def _identity():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+class RecentWriters:
+    """
+    Identities that wrote in the last ttl seconds, as expiring keys in a
+    Redis-compatible store so that every worker and node sees them
+    """
+    def __init__(self, client, ttl=5, prefix='wrote:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def add(self, identity):
+        self.client.set(f'{self.prefix}{identity}', 1, ex=max(1, self.ttl))
+
+    def __contains__(self, identity):
+        return bool(self.client.exists(f'{self.prefix}{identity}'))
+
+
+def create_recent_writers(app):
+    backend = app.config['REPLICA_STICKY_BACKEND']
+    if backend == 'memory':
+        from .revocation import MemoryKeyValueClient
+        client = MemoryKeyValueClient()
+    elif backend == 'redis':
+        import redis
+        client = redis.Redis.from_url(app.config['REPLICA_STICKY_REDIS_URL'])
+    else:
+        raise ValueError(f'Unknown replica sticky backend {backend!r}')
+    return RecentWriters(client, ttl=app.config['REPLICA_STICKY_SECONDS'])
+
+
+def recent_writers():
+    return current_app.extensions['replica_recent_writers']
+
+
+class RoutingSession(Session):
+    """
+    Sends SELECTs made inside a use_replica view to one of the replica binds
+    listed in SQLALCHEMY_REPLICAS. Everything else, and every read after
+    the session has written, goes to the primary.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self._remember_write()
+            elif g.get('replica_key') and not self.info.get('wrote') and self._is_plain_select(clause):
+                return self._db.engines[g.replica_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _is_plain_select(self, clause):
+        return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+    def _remember_write(self):
+        if self.info.get('wrote'):
+            return
+        self.info['wrote'] = True
+        identity = _identity()
+        if identity is not None and current_app.config['SQLALCHEMY_REPLICAS']:
+            recent_writers().add(identity)
+
+
+def use_replica(func):
+    """
+    Let the reads of a read-only view go to a replica, unless the caller
+    wrote in the last REPLICA_STICKY_SECONDS
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.config['SQLALCHEMY_REPLICAS']
+        g.replica_key = None
+        if replicas and _identity() not in recent_writers():
+            g.replica_key = random.choice(replicas)
+        return func(*args, **kwargs)
+    return wrapper
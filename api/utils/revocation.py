@@ -0,0 +1,240 @@
+import fnmatch
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+from . import db
+from .cache import TTLCache, MISSING
+from ..models.blocklist import TokenBlocklist
+
+
+class DatabaseRevocationStore:
+    """
+    Revoked tokens are rows in the blocklist table
+    """
+    def __init__(self, default_ttl=1800):
+        self.default_ttl = default_ttl
+
+    def is_revoked(self, jti, exp=None):
+        return db.session.query(TokenBlocklist.id).filter_by(jti=jti).first() is not None
+
+    def revoke(self, jti, exp=None):
+        if exp is None:
+            exp = time.time() + self.default_ttl
+        token = TokenBlocklist(
+            jti=jti,
+            created_at=datetime.now(timezone.utc),
+            expires_at=datetime.utcfromtimestamp(exp)
+        )
+        db.session.add(token)
+        db.session.commit()
+
+    def revoked_jtis(self):
+        unexpired = db.or_(TokenBlocklist.expires_at.is_(None), TokenBlocklist.expires_at >= datetime.utcnow())
+        return (jti for jti, in db.session.query(TokenBlocklist.jti).filter(unexpired))
+
+
+class CachedRevocationStore:
+    """
+    Bounded per-worker LRU in front of another store. Revoked answers are
+    cached until the token expires, but never longer than max_ttl seconds.
+    Not revoked answers are only cached for negative_ttl seconds, since a
+    logout handled by another worker cannot invalidate this cache.
+    """
+    def __init__(self, backend, maxsize=10000, max_ttl=1800, negative_ttl=5):
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self.cache = TTLCache(maxsize=maxsize, ttl=max_ttl)
+
+    def _ttl(self, exp, revoked=True):
+        ttl = None if exp is None else max(0, exp - time.time())
+        if not revoked:
+            ttl = self.negative_ttl if ttl is None else min(ttl, self.negative_ttl)
+        return ttl
+
+    def invalidate(self, jti):
+        self.cache.pop(jti)
+
+    def is_revoked(self, jti, exp=None):
+        revoked = self.cache.get(jti)
+        if revoked is MISSING:
+            revoked = self.backend.is_revoked(jti, exp)
+            self.cache.set(jti, revoked, self._ttl(exp, revoked))
+        return revoked
+
+    def revoke(self, jti, exp=None):
+        self.invalidate(jti)
+        self.backend.revoke(jti, exp)
+        self.cache.set(jti, True, self._ttl(exp))
+
+    def revoked_jtis(self):
+        return self.backend.revoked_jtis()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BloomFilterRevocationStore:
+    """
+    Answers "not revoked" from a Bloom filter of revoked jtis and only
+    asks the backend on a possible match. The filter is rebuilt from the
+    backend every refresh_interval seconds to pick up tokens revoked by
+    other workers.
+    """
+    def __init__(self, backend, capacity=100000, error_rate=0.001, refresh_interval=60):
+        self.backend = backend
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._filter = None
+        self._built_at = 0
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for jti in self.backend.revoked_jtis():
+            bloom.add(jti)
+        self._filter = bloom
+        self._built_at = time.monotonic()
+
+    def _current_filter(self):
+        if self._filter is None or time.monotonic() - self._built_at >= self.refresh_interval:
+            with self._lock:
+                if self._filter is None or time.monotonic() - self._built_at >= self.refresh_interval:
+                    self.rebuild()
+        return self._filter
+
+    def is_revoked(self, jti, exp=None):
+        if jti not in self._current_filter():
+            return False
+        return self.backend.is_revoked(jti, exp)
+
+    def revoke(self, jti, exp=None):
+        self.backend.revoke(jti, exp)
+        self._current_filter().add(jti)
+
+    def revoked_jtis(self):
+        return self.backend.revoked_jtis()
+
+
+class MemoryKeyValueClient:
+    """
+    In-process stand-in for the subset of the redis client used by
+    KeyValueRevocationStore
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name):
+        entry = self._data.get(name)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[name]
+            return None
+        return entry
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(self._live(name) is not None for name in names)
+
+    def ttl(self, name):
+        with self._lock:
+            entry = self._live(name)
+            if entry is None:
+                return -2
+            if entry[1] is None:
+                return -1
+            return math.ceil(entry[1] - time.monotonic())
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            names = [name for name in self._data if self._live(name) is not None and fnmatch.fnmatchcase(name, match)]
+        return iter(names)
+
+
+class KeyValueRevocationStore:
+    """
+    Revoked jtis are keys in a shared Redis-compatible store that expire
+    together with the token, so every worker sees a logout immediately
+    """
+    def __init__(self, client, default_ttl=1800, prefix='revoked:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def is_revoked(self, jti, exp=None):
+        return bool(self.client.exists(self.prefix + jti))
+
+    def revoke(self, jti, exp=None):
+        ttl = self.default_ttl if exp is None else exp - time.time()
+        self.client.set(self.prefix + jti, 1, ex=max(1, math.ceil(ttl)))
+
+    def revoked_jtis(self):
+        for name in self.client.scan_iter(match=self.prefix + '*'):
+            if isinstance(name, bytes):
+                name = name.decode()
+            yield name[len(self.prefix):]
+
+
+def create_key_value_client(app):
+    if app.config['REVOCATION_BACKEND'] == 'memory':
+        return MemoryKeyValueClient()
+    import redis
+    return redis.Redis.from_url(app.config['REVOCATION_REDIS_URL'])
+
+
+def max_token_lifetime(app):
+    return max(app.config['JWT_ACCESS_TOKEN_EXPIRES'], app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+
+
+def create_revocation_store(app):
+    backend = app.config['REVOCATION_BACKEND']
+    default_ttl = max_token_lifetime(app).total_seconds()
+    if backend in ('redis', 'memory'):
+        return KeyValueRevocationStore(create_key_value_client(app), default_ttl=default_ttl)
+    if backend != 'database':
+        raise ValueError(f'Unknown revocation backend {backend!r}')
+
+    store = DatabaseRevocationStore(default_ttl=default_ttl)
+    if app.config['REVOCATION_CACHE']:
+        store = CachedRevocationStore(
+            store,
+            maxsize=app.config['REVOCATION_CACHE_SIZE'],
+            max_ttl=app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds(),
+            negative_ttl=app.config['REVOCATION_CACHE_NEGATIVE_TTL']
+        )
+    if app.config['REVOCATION_BLOOM_FILTER']:
+        store = BloomFilterRevocationStore(
+            store,
+            capacity=app.config['REVOCATION_BLOOM_CAPACITY'],
+            refresh_interval=app.config['REVOCATION_BLOOM_REFRESH']
+        )
+    return store
+
+
+def get_revocation_store():
+    return current_app.extensions['revocation_store']
@@ -0,0 +1,55 @@
+"""
+KitchenQueue with 100k pending orders: loading, adding, cancelling and
+taking batches, against sorting every pending order to find one batch.
+
+    DATABASE_URL=sqlite:// DEBUG=False python -m benchmarks.bench_kitchen_queue
+"""
+import random
+import timeit
+from datetime import datetime, timedelta
+from api.models.orders import Sizes, OrderFlavour
+from api.orders.kitchen import KitchenQueue
+
+ORDERS = 100000
+OPERATIONS = 10000
+
+
+def main():
+    start = datetime(2026, 1, 1)
+    rows = [
+        (id, random.choice(list(OrderFlavour)), random.choice(list(Sizes)), start + timedelta(seconds=id), random.randint(1, 3))
+        for id in range(1, ORDERS + 1)
+    ]
+    queue = KitchenQueue()
+
+    seconds = timeit.timeit(lambda: queue.load(rows), number=1)
+    print(f'{"load":>16}: {seconds * 1000:8.1f} ms for {ORDERS} orders')
+
+    new = [
+        (ORDERS + id, random.choice(list(OrderFlavour)), random.choice(list(Sizes)), start + timedelta(seconds=ORDERS + id), 1)
+        for id in range(1, OPERATIONS + 1)
+    ]
+    seconds = timeit.timeit(lambda: [queue.add(*row) for row in new], number=1)
+    print(f'{"add":>16}: {seconds / OPERATIONS * 1e6:8.2f} us per order')
+
+    cancelled = random.sample(range(1, ORDERS + 1), OPERATIONS)
+    seconds = timeit.timeit(lambda: queue.remove(*cancelled), number=1)
+    print(f'{"cancel":>16}: {seconds / OPERATIONS * 1e6:8.2f} us per order')
+
+    seconds = timeit.timeit(lambda: queue.next_batch(take=False), number=OPERATIONS)
+    print(f'{"peek batch":>16}: {seconds / OPERATIONS * 1e6:8.2f} us per batch')
+
+    seconds = timeit.timeit(queue.next_batch, number=OPERATIONS)
+    print(f'{"take batch":>16}: {seconds / OPERATIONS * 1e6:8.2f} us per batch, {len(queue)} orders left')
+
+    def sort_pending():
+        pending = sorted(rows, key=lambda row: row[3])
+        oldest = pending[0]
+        return [row[0] for row in pending if row[1] == oldest[1] and row[2] == oldest[2]][:8]
+
+    seconds = timeit.timeit(sort_pending, number=10)
+    print(f'{"sort all":>16}: {seconds / 10 * 1e6:8.2f} us per batch')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Logins per second through the login endpoint for several password hashing
+costs, with one request at a time as in a sync worker and with concurrent
+requests sharing a bounded hashing pool as in a threaded worker.
+
+    DATABASE_URL=sqlite:// DEBUG=False python -m benchmarks.bench_password_hashing
+"""
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from api import create_app
+from api.config import config_dict
+from api.utils import db
+from api.utils.passwords import get_password_hasher
+
+LOGINS = 40
+THREADS = 4
+VARIANTS = [
+    ('pbkdf2:sha256', 260000, '', 0),
+    ('pbkdf2:sha256', 600000, '', 0),
+    ('pbkdf2:sha256', 260000, 'thread', THREADS),
+    ('pbkdf2:sha256', 260000, 'process', THREADS)
+]
+
+
+def run(method, iterations, executor, workers, concurrency):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+
+    class BenchConfig(config_dict['test']):
+        SQLALCHEMY_ECHO = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        PASSWORD_HASH_METHOD = method
+        PASSWORD_HASH_ITERATIONS = iterations
+        PASSWORD_HASH_EXECUTOR = executor
+        PASSWORD_HASH_WORKERS = workers
+        # every login is for the same account from the same address
+        RATE_LIMIT_AUTH_PER_IP = ''
+        RATE_LIMIT_LOGIN_PER_ACCOUNT = ''
+
+    app = create_app(config=BenchConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+        client = app.test_client()
+        client.post('/auth/signup', json={'username': 'bench', 'email': 'bench@gmail.com', 'password': 'password'})
+
+        def login(_):
+            response = app.test_client().post('/auth/login', json={'email': 'bench@gmail.com', 'password': 'password'})
+            assert response.status_code == 201
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(login, range(LOGINS)))
+        return LOGINS / (time.perf_counter() - start)
+    finally:
+        with app.app_context():
+            get_password_hasher().shutdown()
+        os.remove(path)
+
+
+def main():
+    for method, iterations, executor, workers in VARIANTS:
+        concurrency = THREADS if executor else 1
+        rate = run(method, iterations, executor, workers, concurrency)
+        label = f'{method}:{iterations} {executor or "inline"}'
+        print(f'{label:>32}, {concurrency} concurrent: {rate:7.1f} logins/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Cost of the request metrics hooks: timing a request into the histograms,
+the SQL listeners per statement with and without a request being timed,
+and the same with statement capture for slow request logging.
+
+    DATABASE_URL=sqlite:// DEBUG=False python -m benchmarks.bench_request_metrics
+"""
+import timeit
+from api import create_app
+from api.config import config_dict
+from api.utils.metrics import RequestMetrics, start_query_timer, stop_query_timer
+
+REQUESTS = 100000
+STATEMENT = 'SELECT orders.id, orders.sizes FROM orders WHERE orders.id = ?'
+
+
+class BenchConfig(config_dict['test']):
+    SQLALCHEMY_ECHO = False
+
+
+def query():
+    start_query_timer(None, None, STATEMENT, (), None, False)
+    stop_query_timer(None, None, STATEMENT, (), None, False)
+
+
+def main():
+    app = create_app(config=BenchConfig)
+    with app.test_request_context('/orders/orders'):
+        seconds = timeit.timeit(query, number=REQUESTS)
+        print(f'{"query, idle":>28}: {seconds / REQUESTS * 1e6:6.2f} us per statement')
+
+        for name, metrics in (('request', RequestMetrics()), ('request, slow logging', RequestMetrics(slow_request=60))):
+            def request():
+                metrics.start()
+                metrics.finish()
+
+            seconds = timeit.timeit(request, number=REQUESTS)
+            print(f'{name:>28}: {seconds / REQUESTS * 1e6:6.2f} us per request')
+
+            metrics.start()
+            seconds = timeit.timeit(query, number=REQUESTS)
+            metrics.finish()
+            print(f'{"query, " + name:>28}: {seconds / REQUESTS * 1e6:6.2f} us per statement')
+
+
+if __name__ == '__main__':
+    main()
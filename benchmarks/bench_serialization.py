@@ -0,0 +1,64 @@
+"""
+Compare flask-restx marshalling of ORM instances with the compiled
+Serializer over ORM instances and over column-projected rows, on 10k orders.
+
+    DATABASE_URL=sqlite:// DEBUG=False python -m benchmarks.bench_serialization
+"""
+import json
+import random
+import timeit
+from api import create_app
+from api.config import config_dict
+from api.utils import db
+from api.models.orders import Order, Sizes, OrderStatus, OrderFlavour
+from api.orders.views import order_model
+from api.utils.serializer import Serializer
+from flask_restx import marshal
+
+ORDERS = 10000
+ROUNDS = 5
+
+
+class BenchConfig(config_dict['test']):
+    SQLALCHEMY_ECHO = False
+
+
+def main():
+    app = create_app(config=BenchConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(Order), [
+            {
+                'flavour': random.choice(list(OrderFlavour)),
+                'sizes': random.choice(list(Sizes)),
+                'order_status': random.choice(list(OrderStatus)),
+                'quantity': random.randint(1, 5)
+            }
+            for _ in range(ORDERS)
+        ])
+        db.session.commit()
+        orders = Order.query.all()
+        serializer = Serializer(order_model)
+
+        assert [serializer.serialize(order) for order in orders] == marshal(orders, order_model)
+
+        def load_orders():
+            db.session.expunge_all()
+            return Order.query.all()
+
+        def load_rows():
+            return db.session.execute(Order.select_rows()).all()
+
+        results = {
+            'marshal': lambda: json.dumps(marshal(orders, order_model)).encode(),
+            'serializer': lambda: serializer.dumps(orders),
+            'orm load + marshal': lambda: json.dumps(marshal(load_orders(), order_model)).encode(),
+            'row load + serializer': lambda: serializer.dumps(load_rows())
+        }
+        for name, run in results.items():
+            seconds = min(timeit.repeat(run, number=1, repeat=ROUNDS))
+            print(f'{name:>22}: {seconds * 1000:8.1f} ms per {ORDERS} orders')
+
+
+if __name__ == '__main__':
+    main()
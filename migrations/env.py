@@ -4,6 +4,7 @@ from logging.config import fileConfig
 from flask import current_app
 
 from alembic import context
+from sqlalchemy import Column
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -83,13 +84,24 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    def include_object(object, name, type_, reflected, compare_to):
+        # SQLite does not reflect indexes on expressions such as lower(email),
+        # so autogenerate would keep proposing to add them
+        if type_ == 'index' and not reflected and connection.dialect.name == 'sqlite':
+            return all(isinstance(expression, Column) for expression in object.expressions)
+        return True
+
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # schema changes may run longer than the app's statement_timeout
+            connection.exec_driver_sql('SET statement_timeout = 0')
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
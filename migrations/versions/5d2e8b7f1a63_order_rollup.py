@@ -0,0 +1,44 @@
+"""order rollup
+
+Revision ID: 5d2e8b7f1a63
+Revises: e1b7c5a9d042
+Create Date: 2026-10-18 16:42:10.518226
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8b7f1a63'
+down_revision = 'e1b7c5a9d042'
+branch_labels = None
+depends_on = None
+
+
+def existing_enum(*values, name):
+    return sa.Enum(*values, name=name).with_variant(postgresql.ENUM(*values, name=name, create_type=False), 'postgresql')
+
+
+def upgrade():
+    op.create_table('order_rollup',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('customer', sa.Integer(), nullable=False, comment='0 for orders without a customer'),
+    sa.Column('flavour', existing_enum('BBQ_CHICKEN', 'PEPPERONI', 'SAUSAGE', 'CHEESE', 'EXTRA_CHEESE', 'BACON', 'PINEAPPLE', 'MARGHERITA', name='orderflavour'), nullable=False),
+    sa.Column('sizes', existing_enum('SMALL', 'MEDIUM', 'LARGE', 'EXTRA_LARGE', name='sizes'), nullable=False),
+    sa.Column('order_status', existing_enum('PENDING', 'IN_TRANSIT', 'DELIVERED', name='orderstatus'), nullable=False),
+    sa.Column('orders', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'customer', 'flavour', 'sizes', 'order_status')
+    )
+    op.execute(
+        "INSERT INTO order_rollup (day, customer, flavour, sizes, order_status, orders, quantity) "
+        "SELECT date(date_created), COALESCE(customer, 0), flavour, sizes, order_status, count(id), COALESCE(sum(quantity), 0) "
+        "FROM orders WHERE date_created IS NOT NULL AND sizes IS NOT NULL AND order_status IS NOT NULL "
+        "GROUP BY date(date_created), COALESCE(customer, 0), flavour, sizes, order_status"
+    )
+
+
+def downgrade():
+    op.drop_table('order_rollup')
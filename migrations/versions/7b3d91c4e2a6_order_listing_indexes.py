@@ -0,0 +1,34 @@
+"""order listing indexes
+
+Revision ID: 7b3d91c4e2a6
+Revises: 2e5a4f437d4d
+Create Date: 2026-10-18 09:12:41.203117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3d91c4e2a6'
+down_revision = '2e5a4f437d4d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_date_created_id', ['date_created', 'id'], unique=False)
+        batch_op.create_index('ix_orders_order_status_date_created_id', ['order_status', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_orders_flavour_date_created_id', ['flavour', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_orders_sizes_date_created_id', ['sizes', 'date_created', 'id'], unique=False)
+        batch_op.create_index('ix_orders_customer_date_created_id', ['customer', 'date_created', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_customer_date_created_id')
+        batch_op.drop_index('ix_orders_sizes_date_created_id')
+        batch_op.drop_index('ix_orders_flavour_date_created_id')
+        batch_op.drop_index('ix_orders_order_status_date_created_id')
+        batch_op.drop_index('ix_orders_date_created_id')
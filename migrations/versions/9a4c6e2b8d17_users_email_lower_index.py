@@ -0,0 +1,24 @@
+"""users email lower index
+
+Revision ID: 9a4c6e2b8d17
+Revises: 5d2e8b7f1a63
+Create Date: 2026-10-18 17:20:34.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c6e2b8d17'
+down_revision = '5d2e8b7f1a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
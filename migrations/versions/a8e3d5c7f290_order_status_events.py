@@ -0,0 +1,53 @@
+"""order status events
+
+Revision ID: a8e3d5c7f290
+Revises: f2c8e4b6a913
+Create Date: 2026-10-18 21:12:47.305912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e3d5c7f290'
+down_revision = 'f2c8e4b6a913'
+branch_labels = None
+depends_on = None
+
+
+def existing_enum(*values, name):
+    return sa.Enum(*values, name=name).with_variant(postgresql.ENUM(*values, name=name, create_type=False), 'postgresql')
+
+
+def upgrade():
+    op.create_table('order_status_events',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False, comment='Kept after the order is deleted'),
+    sa.Column('status', existing_enum('PENDING', 'IN_TRANSIT', 'DELIVERED', name='orderstatus'), nullable=False),
+    sa.Column('at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('order_status_events', schema=None) as batch_op:
+        batch_op.create_index('ix_order_status_events_order_id_at', ['order_id', 'at'], unique=False)
+        batch_op.create_index('ix_order_status_events_status_at', ['status', 'at'], unique=False)
+
+    # existing orders get their placement and, if it moved on, their current status
+    op.execute(
+        "INSERT INTO order_status_events (order_id, status, at) "
+        "SELECT id, 'PENDING', date_created FROM orders WHERE date_created IS NOT NULL"
+    )
+    op.execute(
+        "INSERT INTO order_status_events (order_id, status, at) "
+        "SELECT id, order_status, COALESCE(updated_at, date_created) FROM orders "
+        "WHERE order_status IS NOT NULL AND order_status <> 'PENDING' AND date_created IS NOT NULL"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('order_status_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_status_events_status_at')
+        batch_op.drop_index('ix_order_status_events_order_id_at')
+
+    op.drop_table('order_status_events')
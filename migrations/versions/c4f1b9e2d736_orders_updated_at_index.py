@@ -0,0 +1,26 @@
+"""orders updated_at index
+
+Revision ID: c4f1b9e2d736
+Revises: a8e3d5c7f290
+Create Date: 2026-10-18 23:05:19.640183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f1b9e2d736'
+down_revision = 'a8e3d5c7f290'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_updated_at', ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_updated_at')
@@ -0,0 +1,28 @@
+"""blocklist expires_at
+
+Revision ID: c4f8a2d6e913
+Revises: 7b3d91c4e2a6
+Create Date: 2026-10-18 11:40:27.519364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a2d6e913'
+down_revision = '7b3d91c4e2a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blocklist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_blocklist_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('blocklist', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blocklist_expires_at'))
+        batch_op.drop_column('expires_at')
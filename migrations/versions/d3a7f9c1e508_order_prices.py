@@ -0,0 +1,34 @@
+"""order prices
+
+Revision ID: d3a7f9c1e508
+Revises: b6f1d3a8c254
+Create Date: 2026-10-18 18:47:15.640283
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7f9c1e508'
+down_revision = 'b6f1d3a8c254'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unit_price', sa.Numeric(precision=10, scale=2), nullable=True))
+        batch_op.add_column(sa.Column('total', sa.Numeric(precision=12, scale=2), nullable=True))
+
+    with op.batch_alter_table('order_rollup', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('revenue', sa.Numeric(precision=14, scale=2), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('order_rollup', schema=None) as batch_op:
+        batch_op.drop_column('revenue')
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('total')
+        batch_op.drop_column('unit_price')